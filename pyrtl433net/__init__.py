@@ -19,6 +19,10 @@ WS85 = m=FSK_PCM,s=58,l=58,r=2048,preamble=aa2dd4
 ==== server.cfg ====
 
 The --handler is a import'able python object with an rtl433_handler(server,client,packet) function to handle the incoming packets.
+The rtl433_handler can also be an async def coroutine, which pairs with the asyncio engine:
+	python3 -m pyrtl433net --server server.cfg --handler myhandler --engine asyncio
+
+The engine can also be set in server.cfg with "engine = asyncio" in the [server] section.
 
 
 To run as the client, supply the --client switch with the server and port to connect to:
@@ -29,19 +33,85 @@ The only configuration the client takes is the interface and port of the server,
 """
 
 import argparse
+import asyncio
+import collections
+import collections.abc
 import configparser
+import hashlib
+import http.server
 import importlib
 import inspect
 import json
+import math
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import signal
 import socket
 import socketserver
+import struct
 import sys
+import threading
 import time
+import zlib
 
 DEFAULT_PORT = 4333
 DEFAULT_BIN = 'rtl_433'
-
-__all__ = ['parse_args', 'server', 'client']
+DEFAULT_ENGINE = 'socketserver'
+DEFAULT_QUEUE_SIZE = 1000
+BUSY_BACKOFF = 0.1
+DEFAULT_BATCH_LATENCY = 0.5
+DEFAULT_BATCH_BYTES = 8000
+DEFAULT_WINDOW = 8
+DEFAULT_SPOOL_SIZE = 16*1024*1024
+DEFAULT_DRAIN_RATE = 500
+DEFAULT_BUFFER = 10000
+# Lines read from rtl_433 waiting to be sent, and what to do with more
+DEFAULT_READ_QUEUE = 10000
+OVERFLOW_POLICIES = ('drop-oldest', 'spool', 'conflate')
+DEFAULT_SEQ_WINDOW = 1024
+DEFAULT_MAX_SESSIONS = 4096
+# Packets kept per sensor of each session for delta encoding
+DEFAULT_DELTA_VERSIONS = 8
+# Delta encoded requests a TCP client keeps to send again if the server asks it to resync
+DEFAULT_DELTA_UNACKED = 1024
+
+# Fields that differ between radios hearing the same transmission
+DEFAULT_DEDUP_WINDOW = 2.0
+DEFAULT_DEDUP_IGNORE = ('time', 'ts', 'rssi', 'snr', 'noise', 'freq', 'freq1', 'freq2', 'radio')
+# Fields pyrtl433net adds to packets, which always differ between radios so they are ignored whatever the configuration says
+DEDUP_ADDED_FIELDS = ('ts', 'radio')
+DEFAULT_AGGREGATE_WINDOW = 0.5
+DEFAULT_AGGREGATE_PENDING = 10000
+
+# Start of an rtl_433 line with the time the client read it spliced in, for the server to timestamp and trace it
+TRACE_PREFIX = b'{"_tr" : '
+# Clock samples the client picks the shortest round trip from, and how much of a change in offset is taken at once
+CLOCK_SAMPLES = 8
+CLOCK_GAIN = 0.25
+# Traced packets kept for export, and how often the export is written
+DEFAULT_TRACE_EVENTS = 10000
+TRACE_INTERVAL = 10.0
+
+# How often the server engines do periodic work
+SERVICE_INTERVAL = 0.05
+# How often to check if the configuration file changed
+WATCH_INTERVAL = 1.0
+# How often worker processes send their handler timings back to the server process
+PROCESS_REPORT_INTERVAL = 1.0
+
+# Largest UDP payload
+MAX_DATAGRAM = 65507
+
+# TCP messages are prefixed with their length
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME = 16*1024*1024
+TRANSPORTS = ('udp', 'tcp')
+ENGINES = ('socketserver', 'asyncio')
+
+__all__ = ['parse_args', 'config_hash', 'jsoncodec', 'bincodec', 'rawcodec', 'zlibcodec', 'CODECS', 'codec_for', 'lazypacket', 'sensor_key', 'dispatcher', 'processdispatcher', 'fingerprint', 'deduplicator', 'aggregator', 'seqwindow', 'deltastore', 'histogram', 'metrics', 'tracer', 'server', 'spool', 'memspool', 'client']
 
 def parse_args(args=None):
 	"""
@@ -54,10 +124,28 @@ def parse_args(args=None):
 		description="Run multiple instances to work a network of rtl_433 software defined radios and feed received data to a single server"
 	)
 	p.add_argument('--server', action="store", nargs=1, metavar="CONFIG_FILE", help="Run as the server using the specified config file")
-	p.add_argument('--client', action="store", nargs=1, metavar="IP:[PORT]", help="Run as the clinet connecting to the specified server")
-	p.add_argument('--rtl433', action="store", nargs=1, metavar="ARG", default=DEFAULT_BIN, help="Override the rtl_433 binary name, can specify the path too")
+	p.add_argument('--client', action="store", nargs=1, metavar="IP:[PORT]", help="Run as the clinet connecting to the specified server, use tcp://IP:[PORT] for the TCP transport")
+	p.add_argument('--rtl433', action="store", nargs=1, metavar="ARG", default=[DEFAULT_BIN], help="Override the rtl_433 binary name, can specify the path too")
+	p.add_argument('--batch', action="store", nargs=1, type=int, metavar="N", default=[1], help="Client gathers up to N packets and sends them in one request, default is 1 (no batching)")
+	p.add_argument('--batch-latency', action="store", nargs=1, type=float, metavar="SEC", default=[DEFAULT_BATCH_LATENCY], help="Longest time in seconds a packet waits for a batch to fill, default is %.1f" % DEFAULT_BATCH_LATENCY)
+	p.add_argument('--batch-bytes', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_BATCH_BYTES], help="Most bytes of packets in one batch, default is %d" % DEFAULT_BATCH_BYTES)
+	p.add_argument('--window', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_WINDOW], help="Most requests the client keeps in flight waiting on a response, 1 is stop-and-wait, default is %d" % DEFAULT_WINDOW)
+	p.add_argument('--codec', action="store", nargs=1, choices=list(CODECS), default=[jsoncodec.name], help="Wire codec the client asks the server for, bin1 is about half the bytes of json but costs more CPU to encode, default is json")
+	p.add_argument('--raw', action="store_true", default=False, help="Client forwards rtl_433 output lines to the server without parsing them, which saves client CPU, if the server supports it")
+	p.add_argument('--compress', action="store_true", default=False, help="Client compresses packet requests with a zlib dictionary of typical rtl_433 output, if the server supports it")
+	p.add_argument('--delta', action="store_true", default=False, help="Client sends only the fields that changed since the last packet from the same sensor, if the server supports it (not with --raw)")
+	p.add_argument('--spool', action="store", nargs=1, metavar="FILE", help="Client keeps rtl_433 running when the server is unreachable and stores packets in this file until the server is back")
+	p.add_argument('--spool-size', action="store", nargs=1, type=int, metavar="BYTES", default=[DEFAULT_SPOOL_SIZE], help="Size of the spool file, when full the oldest packets are dropped, default is %d" % DEFAULT_SPOOL_SIZE)
+	p.add_argument('--drain-rate', action="store", nargs=1, type=float, metavar="N", default=[DEFAULT_DRAIN_RATE], help="Most spooled packets per second sent once the server is back, default is %d" % DEFAULT_DRAIN_RATE)
+	p.add_argument('--buffer', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_BUFFER], help="Without --spool, the most packets held in memory while the server is unreachable, default is %d" % DEFAULT_BUFFER)
+	p.add_argument('--device', action="append", metavar="DEV", help="Client runs one rtl_433 for each --device (passed to -d, eg 0) over one connection, and tags each packet with its radio")
+	p.add_argument('--read-queue', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_READ_QUEUE], help="Most rtl_433 lines read and waiting to be sent, default is %d" % DEFAULT_READ_QUEUE)
+	p.add_argument('--overflow', action="store", nargs=1, choices=OVERFLOW_POLICIES, default=[OVERFLOW_POLICIES[0]], help="What to do with rtl_433 lines when the read queue is full: drop-oldest (default), spool them, or conflate to the latest line of each sensor")
+	p.add_argument('--trace', action="store_true", default=False, help="Client stamps packets with when they are read and sent so the server can break down their latency, if the server supports it")
+	p.add_argument('--stats', action="store_true", default=False, help="Client asks the server for its statistics, prints them, and quits")
 	p.add_argument('--dryrun', action="store_true", default=False, help="Dry run for the client, meaning this will formulate the rtl_433 command, print it out, and quit. This does require the server to be running to get the configuration. For the server, this will parse the configuration, print it out, and quit without binding the server socket.")
 	p.add_argument('--handler', action="store", nargs=1, metavar="PY", help="Python handler for packets, this is fed to importlib.import_module and rtl433_handler(server, client, packet) is called for each packet received")
+	p.add_argument('--engine', action="store", nargs=1, choices=ENGINES, help="Server engine, overrides the [server] engine option: socketserver handles one datagram at a time, asyncio keeps receiving while async def handlers run")
 
 	args = p.parse_args(args)
 	if not args.server and not args.client:
@@ -65,267 +153,3655 @@ def parse_args(args=None):
 		sys.exit(-1)
 	return args
 
-class server:
+class dispatcher:
 	"""
-	UDP server that listens for packets from the clients.
-	Transport layer is JSON encoded at UTF-8.
-
-	Requests from clients contain and 'cmd' key:
-		getconfig returns the configuration parsed from the server.cfg
-		packet is a radio packet received at the client end
+	Bounded queue and pool of worker threads that run the packet handler.
+	The server acknowledges a packet once it is queued, and the workers call the handler at their own pace.
+	If the queue is full then the packet is refused and counted as dropped.
 
-	Returned is object of
-		ret=ok if the packet was received
-		ret=error if there was an error, and the error key is set with something meaningful
-		ret=exception if there was an exception of some kind with exception key as a two tuple (exception type name, exception string value)
+	@call is the function called as call(client, packet, trace) by the workers, trace is what was given to submit().
+	@workers is the number of worker threads.
+	@size is the maximum number of packets that can be waiting in the queue.
 	"""
 
-	class _MyUDPHandler(socketserver.BaseRequestHandler):
+	def __init__(self, call, workers, size):
+		self._call = call
+		self._workers = workers
+		self._queue = queue.Queue(maxsize=size)
+		self._threads = []
+		self._lock = threading.Lock()
+
+		self.queued = 0
+		self.dropped = 0
+		self.handled = 0
+		self.errors = 0
+		self.max_depth = 0
+		self.wait_total = 0.0
+		self.wait_max = 0.0
+
+	def start(self):
 		"""
-		Handler class for a UDP server.
+		Start the worker threads.
 		"""
 
-		def handle(self):
-			# request is a 2 tuple of (data,socket)
-			data = self.request[0]
-			sock = self.request[1]
+		for i in range(self._workers):
+			t = threading.Thread(target=self._worker, name="pyrtl433net-worker-%d" % i, daemon=True)
+			t.start()
+			self._threads.append(t)
+
+	def stop(self):
+		"""
+		Let the workers finish what is queued and wait for them to quit.
+		"""
+
+		# One sentinel per worker
+		for t in self._threads:
+			self._queue.put(None)
+		for t in self._threads:
+			t.join()
+		self._threads = []
+
+	def submit(self, client, packet, trace=None):
+		"""
+		Queue @packet from @client for the workers, with its @trace if it is traced.
+		Returns False if the queue is full and the packet was dropped.
+		"""
+
+		try:
+			self._queue.put_nowait( (time.monotonic(), client, packet, trace) )
+		except queue.Full:
+			with self._lock:
+				self.dropped += 1
+			return False
+
+		with self._lock:
+			self.queued += 1
+			self.max_depth = max(self.max_depth, self._queue.qsize())
+		return True
+
+	def stats(self):
+		"""
+		Return a dictionary of the queue depth, drop counts, and time spent waiting in the queue.
+		"""
+
+		with self._lock:
+			return {
+				'workers': self._workers,
+				'depth': self._queue.qsize(),
+				'max_depth': self.max_depth,
+				'queued': self.queued,
+				'dropped': self.dropped,
+				'handled': self.handled,
+				'errors': self.errors,
+				'wait_avg': self.wait_total / self.handled if self.handled else 0.0,
+				'wait_max': self.wait_max,
+			}
+
+	def _worker(self):
+		"""
+		Worker thread loop, pull from the queue and call the handler until a None sentinel is pulled.
+		"""
+
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+
+			queued_at,client,packet,trace = item
+			wait = time.monotonic() - queued_at
 			try:
-				# Expect that the data is a JSON object, handle, and return a serialized JSON ojbect
-				j = json.loads(data)
-				ret = self._handle(j)
-				ret = json.dumps(ret)
+				self._call(client, packet, trace)
+				err = False
 			except Exception as e:
-				return {"ret": "exception", "exception": (str(type(e)), e.args)}
+				print("Handler exception: %s(%s)" % (str(type(e)), e.args))
+				err = True
+
+			with self._lock:
+				self.handled += 1
+				self.errors += err
+				self.wait_total += wait
+				self.wait_max = max(self.wait_max, wait)
+
+def config_hash(cfg):
+	"""
+	Return a hash of configuration @cfg.
+	The server uses it as the configuration version and the client uses it to tell if rtl_433 has to be restarted.
+	"""
+
+	return hashlib.sha1(json.dumps(cfg, sort_keys=True).encode('utf-8')).hexdigest()
+
+class jsoncodec:
+	"""
+	Encodes messages as UTF-8 JSON, the original wire format that every peer understands.
+	"""
+
+	name = 'json'
+
+	@staticmethod
+	def encode(obj):
+		return json.dumps(obj).encode('utf-8')
+
+	@staticmethod
+	def decode(dat):
+		return json.loads(dat)
+
+class bincodec:
+	"""
+	Compact binary encoding of messages, negotiated with getconfig.
+	A message is the MAGIC byte followed by a tagged value:
+		None, False, True are a single tag byte
+		int is a zigzag varint
+		float with at most 3 decimals (what rtl_433 prints, eg rssi/snr/freq) is a zigzag varint of the value times 1000,
+		  other floats are 8 byte doubles
+		str is a varint length and UTF-8, or a single byte index for strings in VALUES
+		list is a varint count and the values
+		dict is a varint count and pairs of key and value, where a key in KEYS is a single byte and others are 0xFF,
+		  a varint length, and UTF-8
+
+	KEYS and VALUES are the interned tables for this version of the codec and must never be reordered.
+	"""
 
-			# Convert return value back to JSON to ship over
-			sock.sendto(ret.encode('utf-8'), self.client_address)
+	name = 'bin1'
+	MAGIC = 0xB1
+
+	KEYS = (
+		# Protocol
+		'cmd', 'ret', 'seq', 'session', 'version', 'packet', 'packets', 'config', 'codecs', 'codec', 'count',
+		'accepted', 'repeat', 'error', 'exception',
+		# rtl_433 common fields
+		'time', 'model', 'id', 'channel', 'subtype', 'battery_ok', 'battery_mV', 'mic', 'mod', 'freq', 'freq1', 'freq2',
+		'rssi', 'snr', 'noise', 'num_rows', 'rows', 'len', 'data', 'codes', 'button', 'state', 'status', 'flags',
+		# rtl_433 sensor readings
+		'temperature_C', 'temperature_F', 'humidity', 'moisture', 'boost', 'ad_raw', 'pressure_hPa', 'pressure_kPa',
+		'wind_avg_km_h', 'wind_max_km_h', 'wind_avg_m_s', 'wind_max_m_s', 'wind_dir_deg', 'rain_mm', 'rain_in',
+		'uv', 'uvi', 'light_lux', 'battery_V', 'radio_clock', 'sequence_num', 'tamper', 'alarm', 'event', 'code',
+		'pressure_PSI', 'storm_dist', 'strike_count', 'depth_cm',
+	)
 
-		def _handle(self, data):
-			"""
-			Actually handle the client data.
-			Executing/handling commands is done here.
-			"""
+	VALUES = (
+		'ok', 'busy', 'error', 'exception', 'getconfig', 'packet', 'batch', 'version',
+		'FSK', 'OOK', 'CRC', 'CHECKSUM', 'PARITY', 'DIGEST',
+	)
 
-			if data['cmd'] == 'getconfig':
-				return {"ret": "ok", 'config': self.server._config}
+	@classmethod
+	def encode(cls, obj):
+		out = bytearray([cls.MAGIC])
+		_bin_encode(out, obj)
+		return bytes(out)
+
+	@classmethod
+	def decode(cls, dat):
+		if not len(dat) or dat[0] != cls.MAGIC:
+			raise ValueError("Not a %s message" % cls.name)
+
+		v,off = _bin_decode(memoryview(dat), 1)
+		if off != len(dat):
+			raise ValueError("Trailing bytes after %s message" % cls.name)
+		return v
+
+# bincodec tags and tables, as module globals since the encoder is called for every value
+_BIN_NONE, _BIN_FALSE, _BIN_TRUE, _BIN_INT, _BIN_MILLI, _BIN_DOUBLE, _BIN_STR, _BIN_ISTR, _BIN_LIST, _BIN_DICT = range(10)
+_BIN_KEYINDEX = {k:i for i,k in enumerate(bincodec.KEYS)}
+_BIN_VALUEINDEX = {k:i for i,k in enumerate(bincodec.VALUES)}
+_BIN_DOUBLE_STRUCT = struct.Struct('<d')
+
+def _bin_varint(out, n):
+	if n < 0x80:
+		out.append(n)
+		return
+	while n > 0x7F:
+		out.append((n & 0x7F) | 0x80)
+		n >>= 7
+	out.append(n)
+
+def _bin_encode(out, v):
+	"""
+	Append bincodec encoding of @v to bytearray @out.
+	Types are checked roughly in order of how common they are in rtl_433 packets.
+	"""
 
-			elif data['cmd'] == 'packet':
-				self.server._handler.rtl433_handler(self.server, self.client_address, data['packet'])
-				return {"ret": "ok"}
+	t = type(v)
+	if t is str:
+		i = _BIN_VALUEINDEX.get(v)
+		if i is not None:
+			out.append(_BIN_ISTR)
+			out.append(i)
+		else:
+			b = v.encode('utf-8')
+			out.append(_BIN_STR)
+			_bin_varint(out, len(b))
+			out += b
+	elif t is float:
+		# Range check also keeps inf and nan out of the fixed point form
+		m = round(v * 1000) if -1e15 < v < 1e15 else None
+		if m is not None and m / 1000 == v:
+			out.append(_BIN_MILLI)
+			_bin_varint(out, (m << 1) if m >= 0 else ((-m << 1) - 1))
+		else:
+			out.append(_BIN_DOUBLE)
+			out += _BIN_DOUBLE_STRUCT.pack(v)
+	elif t is dict:
+		out.append(_BIN_DICT)
+		_bin_varint(out, len(v))
+		for k,x in v.items():
+			i = _BIN_KEYINDEX.get(k)
+			if i is not None:
+				out.append(i)
+			else:
+				b = str(k).encode('utf-8')
+				out.append(0xFF)
+				_bin_varint(out, len(b))
+				out += b
+			_bin_encode(out, x)
+	elif v is None:
+		out.append(_BIN_NONE)
+	elif v is True:
+		out.append(_BIN_TRUE)
+	elif v is False:
+		out.append(_BIN_FALSE)
+	elif isinstance(v, int):
+		out.append(_BIN_INT)
+		_bin_varint(out, (v << 1) if v >= 0 else ((-v << 1) - 1))
+	elif isinstance(v, (list, tuple)):
+		out.append(_BIN_LIST)
+		_bin_varint(out, len(v))
+		for x in v:
+			_bin_encode(out, x)
+	elif isinstance(v, float):
+		# float subclass
+		_bin_encode(out, float(v))
+	elif isinstance(v, str):
+		_bin_encode(out, str(v))
+	elif isinstance(v, dict):
+		_bin_encode(out, dict(v))
+	else:
+		raise TypeError("Cannot encode %s" % t)
+
+def _bin_readvarint(dat, off):
+	b = dat[off]
+	if b < 0x80:
+		return b,off + 1
+
+	n = 0
+	shift = 0
+	while True:
+		b = dat[off]
+		off += 1
+		n |= (b & 0x7F) << shift
+		if b < 0x80:
+			return n,off
+		shift += 7
+
+def _bin_decode(dat, off):
+	"""
+	Decode the bincodec value at @off in memoryview @dat, returns the value and the offset after it.
+	"""
 
+	t = dat[off]
+	off += 1
+
+	if t == _BIN_STR:
+		n,off = _bin_readvarint(dat, off)
+		return str(dat[off:off+n], 'utf-8'),off + n
+	elif t == _BIN_MILLI or t == _BIN_INT:
+		n,off = _bin_readvarint(dat, off)
+		n = (n >> 1) if not n & 1 else -((n + 1) >> 1)
+		if t == _BIN_MILLI:
+			return n / 1000,off
+		return n,off
+	elif t == _BIN_ISTR:
+		return bincodec.VALUES[dat[off]],off + 1
+	elif t == _BIN_DICT:
+		n,off = _bin_readvarint(dat, off)
+		ret = {}
+		for i in range(n):
+			k = dat[off]
+			off += 1
+			if k == 0xFF:
+				m,off = _bin_readvarint(dat, off)
+				k = str(dat[off:off+m], 'utf-8')
+				off += m
 			else:
-				print("Unknown command")
-				print(data)
-				return {"ret": 'error', "error": 'Unrecognized command'}
+				k = bincodec.KEYS[k]
+			ret[k],off = _bin_decode(dat, off)
+		return ret,off
+	elif t == _BIN_LIST:
+		n,off = _bin_readvarint(dat, off)
+		ret = []
+		for i in range(n):
+			v,off = _bin_decode(dat, off)
+			ret.append(v)
+		return ret,off
+	elif t == _BIN_DOUBLE:
+		return _BIN_DOUBLE_STRUCT.unpack_from(dat, off)[0],off + _BIN_DOUBLE_STRUCT.size
+	elif t == _BIN_NONE:
+		return None,off
+	elif t == _BIN_FALSE:
+		return False,off
+	elif t == _BIN_TRUE:
+		return True,off
+	else:
+		raise ValueError("Unknown %s tag %d" % (bincodec.name, t))
+
+class rawcodec:
+	"""
+	Batch of rtl_433 output lines forwarded untouched by a client in passthrough mode, so the JSON is only parsed by the server.
+	A message is the MAGIC byte, the 8 byte session, the seq as a 64 bit big-endian integer, and the lines joined by newlines.
+	It decodes to a batch request; responses to it are JSON.
+	"""
 
-	def load(self, fname):
+	name = 'raw1'
+	MAGIC = 0xB0
+	HEADER = struct.Struct('>B8sQ')
+
+	@classmethod
+	def encodelines(cls, session, seq, lines):
+		"""
+		Encode @lines (bytes or memoryview slices, without newlines) as a batch request from @session (8 bytes) numbered @seq.
 		"""
-		From @fname, load it in as a configuration file for the server.
-		Expected sections:
-			[server] contains interface and port to specify where to listen
-			[rtl433] contains frequency, metadata, and fsk
-				frequency is whatever is passed via -f to rtl_433 (eg, "915M" for 915 MHz)
-				metadata is what you want to pass to -M, space-delimited list will result in multiple -M arguments
-				fsk is what you want to pass to -Y for the FSK pulse detector mode, space-delimited list will result in multiple -Y arguments
-			[rtl433.decoders] contains 3 possible options
-				include is what decoders to include using -R, if "*" then all decoders are included
-				exclude is what decoders to exclude, by default this is none
-				key=value is custom generic decoders passed by -X where key is used as the decoder name and formed by "n=key,value"
 
-		This is converted to a simple dictionary object tree and passed to the client when requested.
+		return cls.HEADER.pack(cls.MAGIC, session, seq) + b'\n'.join(lines)
+
+	@staticmethod
+	def encode(obj):
+		return jsoncodec.encode(obj)
+
+	@classmethod
+	def decode(cls, dat, packet=json.loads):
+		"""
+		Decode @dat to a batch request, each line is turned into a packet by calling @packet (eg, lazypacket).
 		"""
 
-		c = configparser.ConfigParser()
-		c.read(fname)
-		if 'server' not in c.sections():
-			raise ValueError("Server config missing a [server] section")
+		magic,session,seq = cls.HEADER.unpack_from(dat)
+		if magic != cls.MAGIC:
+			raise ValueError("Not a %s message" % cls.name)
 
-		self._iface = c.get('server', 'interface', fallback='0.0.0.0')
-		self._port = c.getint('server', 'port', fallback=DEFAULT_PORT)
+		packets = [packet(_) for _ in bytes(dat[cls.HEADER.size:]).split(b'\n')]
+		return {'cmd': 'batch', 'packets': packets, 'session': session.hex(), 'seq': seq}
 
-		self._frequency = c.get('rtl433', 'frequency')
-		self._metadata = c.get('rtl433', 'metadata', fallback=None)
-		self._fsk = c.get('rtl433', 'fsk', fallback=None)
+class zlibcodec:
+	"""
+	Compression of a whole encoded frame (any codec) with a zlib preset dictionary of typical rtl_433 output.
+	A message is the MAGIC byte, the dictionary version byte, and the raw deflate stream of the frame.
+	The client offers the dictionary versions it has in getconfig and the server picks one, versions are never changed
+	once released, a new dictionary is a new version.
+	"""
 
-		# Space-delimited list of options to pass
-		if len(self._metadata):
-			self._metadata = [_.strip() for _ in self._metadata.split(' ')]
-			self._metadata = [_ for _ in self._metadata if len(_)]
+	name = 'zlib'
+	MAGIC = 0xB2
+	HEADER = struct.Struct('>BB')
+
+	# Most common strings go last as they are the closest to the data
+	ZDICTS = {
+		1: (
+			b'"subtype": "type": "channel": "button": "state": "status": "flags": "code": "unit": "group": "command": '
+			b'"pressure_hPa": "pressure_kPa": "wind_avg_km_h": "wind_max_km_h": "wind_avg_m_s": "wind_max_m_s": '
+			b'"wind_dir_deg": "rain_mm": "rain_in": "rain_rate_mm_h": "uv": "uvi": "light_lux": "lux": '
+			b'"temperature_F": "humidity": "moisture": "boost": "ad_raw": "battery_mV": "supercap_V": '
+			b'"num_rows": "rows": [{"len": "data": "codes": ["{'
+			b'"model": "Acurite-Tower", "model": "Acurite-5n1", "model": "LaCrosse-TX141THBv2", "model": "Oregon-THGR122N", '
+			b'"model": "Nexus-TH", "model": "Prologue-TH", "model": "Ambientweather-F007TH", "model": "Fineoffset-WH51", '
+			b'"model": "Fineoffset-WH65B", "model": "Fineoffset-WS80", "model": "Fineoffset-WH32B", "model": "Bresser-6in1", '
+			b'"model": "Schrader", "model": "Toyota", "model": "Citroen", "model": "Renault", "model": "Interlogix-Security", '
+			b'"mic": "CHECKSUM", "mic": "PARITY", "mic": "DIGEST", "mic": "CRC", "battery_ok": 0, "battery_ok": 1, '
+			b'"temperature_C": "freq": 433.9, "freq": 868.3, "freq1": 914.9, "freq2": 915.0, "mod": "OOK", "mod": "FSK", '
+			b'"rssi": -0.1, "snr": 2, "noise": -2, "time": "2024-01-01 00:00:00", "model": "", "id": '
+			b'"cmd": "batch", "packets": [{"time": "20'
+		),
+	}
+
+	@classmethod
+	def compress(cls, dat, version, level=6):
+		"""
+		Compress encoded frame @dat with dictionary @version.
+		"""
 
-		# Space-delimited list of options to pass
-		if len(self._fsk):
-			self._fsk = [_.strip() for _ in self._fsk.split(' ')]
-			self._fsk = [_ for _ in self._fsk if len(_)]
+		c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=cls.ZDICTS[version])
+		return cls.HEADER.pack(cls.MAGIC, version) + c.compress(dat) + c.flush()
 
-		self._include = c.get('rtl433.decoders', 'include', fallback='*')
-		self._exclude = c.get('rtl433.decoders', 'exclude', fallback=None)
-		self._customs = []
-		for key in c['rtl433.decoders']:
-			if key in ('include', 'exclude'): continue
+	@classmethod
+	def decompress(cls, dat):
+		"""
+		Return the encoded frame in @dat, at most MAX_FRAME bytes.
+		"""
 
-			val = c['rtl433.decoders'][key]
-			self._customs.append( 'n=%s,%s' % (key,val) )
+		magic,version = cls.HEADER.unpack_from(dat)
+		if magic != cls.MAGIC:
+			raise ValueError("Not a %s message" % cls.name)
+		if version not in cls.ZDICTS:
+			raise ValueError("Unknown %s dictionary version %d" % (cls.name, version))
+
+		d = zlib.decompressobj(-15, zdict=cls.ZDICTS[version])
+		ret = d.decompress(memoryview(dat)[cls.HEADER.size:], MAX_FRAME)
+		if len(d.unconsumed_tail) or not d.eof:
+			raise ValueError("Truncated or oversized %s message" % cls.name)
+		return ret
+
+# Codecs by name, in order of preference
+CODECS = {
+	bincodec.name: bincodec,
+	jsoncodec.name: jsoncodec,
+}
+
+def codec_for(dat):
+	"""
+	Return the codec that message @dat is encoded with, a message starting with a codec's MAGIC byte is that codec,
+	anything else is JSON.
+	"""
 
-		self._config = {
-			'frequency': self._frequency,
-			'metadata': self._metadata,
-			'fsk': self._fsk,
-			'decoders': {
-				'include': self._include,
-				'exclude': self._exclude,
-				'customs': self._customs,
-			},
-		}
+	if len(dat):
+		if dat[0] == bincodec.MAGIC:
+			return bincodec
+		elif dat[0] == rawcodec.MAGIC:
+			return rawcodec
+		elif dat[0] == zlibcodec.MAGIC:
+			return zlibcodec
+	return jsoncodec
 
-	def serve_forever(self, args):
+class lazypacket(collections.abc.Mapping):
+	"""
+	Read-only packet that keeps the rtl_433 JSON line @raw and only decodes the fields that are looked at.
+	A simple field (string, number, true/false/null) at the top level is found with a regular expression without
+	decoding the rest, anything else (or iterating the packet) decodes the whole line once.
+	The line is available as raw for handlers that pass it on, and only the line is pickled.
+	"""
+
+	# Compiled pattern and quoted key for each key looked up, None for keys that are always decoded the slow way
+	_patterns = {}
+	_CONSTANTS = {b'true': True, b'false': False, b'null': None}
+	# Strings are taken out before counting braces, as values like rtl_433 codes ("{25}...") have them
+	_STRINGS = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+	def __init__(self, raw):
+		self.raw = bytes(raw)
+		# Fields found so far, and the whole packet once decoded
+		self._fields = {}
+		self._packet = None
+
+	def __reduce__(self):
+		return (__class__, (self.raw,))
+
+	def __repr__(self):
+		return "lazypacket(%r)" % self.raw
+
+	def decode(self):
 		"""
-		Basic server function to handle incoming packets from clients.
-		Bind to socket, listen, and invoke _MyUDPHandler to handle the packets.
+		Decode the whole line and return the packet as a dict.
 		"""
 
-		if args.handler is None:
-			raise Exception("Expect a handler to be provided with --handler")
+		if self._packet is None:
+			self._packet = json.loads(self.raw)
+			if not isinstance(self._packet, dict):
+				raise ValueError("rtl_433 line is not a JSON object")
+		return self._packet
 
-		# Ensure the handler function is good
-		hand = importlib.import_module(args.handler[0])
-		fname = 'rtl433_handler'
-		if fname not in dir(hand):
-			raise ValueError("Imported handler object does not have a function named %s()" % fname)
+	@classmethod
+	def _pattern(cls, key):
+		try:
+			return cls._patterns[key]
+		except KeyError:
+			pass
 
-		# Get function as an object
-		f = hand.rtl433_handler
+		ret = None
+		if isinstance(key, str) and key.isidentifier() and key.isascii():
+			quoted = b'"' + key.encode('ascii') + b'"'
+			ret = (re.compile(re.escape(quoted) + rb'\s*:\s*("(?:[^"\\]|\\.)*"|-?[0-9][0-9.eE+-]*|true|false|null)\s*[,}]'), quoted)
+		cls._patterns[key] = ret
+		return ret
 
-		# Reflect and get arguments
-		fargs = inspect.getfullargspec(f)
-		if len(fargs.args) != 3:
-			raise ValueError("Imported handler object has rtl433_handler() but does not take 3 positional arguments: %s" % str(fargs.args))
+	def __getitem__(self, key):
+		if self._packet is not None:
+			return self._packet[key]
 
-		# Enforce argument names so they're in the right order
-		if fargs.args[0] != 'server': raise ValueError("Imported handler object has rtl433_handler(%s) but first argument is not 'server'" % ",".join(fargs.args))
-		if fargs.args[1] != 'client': raise ValueError("Imported handler object has rtl433_handler(%s) but second argument is not 'client'" % ",".join(fargs.args))
-		if fargs.args[2] != 'packet': raise ValueError("Imported handler object has rtl433_handler(%s) but third argument is not 'packet'" % ",".join(fargs.args))
+		try:
+			return self._fields[key]
+		except KeyError:
+			pass
 
-		with socketserver.UDPServer((self._iface, self._port), __class__._MyUDPHandler) as s:
-			print("Listening to UDP %s:%d" % (self._iface, self._port))
+		pat = self._pattern(key)
+		if pat is not None:
+			raw = self.raw
+			m = pat[0].search(raw)
+			if m is None:
+				if pat[1] not in raw:
+					# Can't be a key if it is nowhere in the line
+					raise KeyError(key)
+
+			# Only trust a match at the top level, ie every brace before it (except the first) is closed, and not in a string
+			# (a quote left once whole strings are taken out)
+			elif self._depth(raw, m.start()) == 1:
+				v = m.group(1)
+				if v[0] == 0x22:
+					# String, JSON only needed for escapes
+					v = v[1:-1].decode('utf-8') if b'\\' not in v else json.loads(v)
+				elif v in self._CONSTANTS:
+					v = self._CONSTANTS[v]
+				elif v.isdigit() or (v[0] == 0x2D and v[1:].isdigit()):
+					v = int(v)
+				else:
+					v = float(v)
+				self._fields[key] = v
+				return v
+
+		return self.decode()[key]
+
+	@classmethod
+	def _depth(cls, raw, pos):
+		"""
+		Return how many braces are open at @pos in line @raw, or None if @pos is inside a string.
+		"""
 
-			# Copy over the config
-			# Access self.server._config within _MyUDPHandler.handle
-			s._config = self._config
-			s._handler = hand
+		head = cls._STRINGS.sub(b'', raw[:pos])
+		if b'"' in head:
+			return None
+		return head.count(b'{') - head.count(b'}')
 
-			s.serve_forever()
+	def __iter__(self):
+		return iter(self.decode())
 
-class client:
+	def __len__(self):
+		return len(self.decode())
+
+def sensor_key(packet):
+	"""
+	Return a stable key identifying the sensor that sent @packet, made of the model, id, and channel fields.
+	Fields that are not present are None.
 	"""
-	UDP client that sends packets to the server.
-	Transport layer is JSON encoded at UTF-8.
 
-	rtl_433 configuration is pulled from the server over this protocol too.
+	return (packet.get('model'), packet.get('id'), packet.get('channel'))
+
+def _process_worker(index, config, handler, q, counters, results):
+	"""
+	Entry point of a processdispatcher worker process.
+	Import @handler and call it for each item pulled from @q until a None sentinel is pulled.
+	@counters is a shared array of [handled, errors, wait_total, wait_max] for this worker.
+	Handler timings and errors, and traced packets with when the handler started and finished, are put on @results
+	every PROCESS_REPORT_INTERVAL seconds for the server's metrics and tracer.
+	time.monotonic() is system-wide, so stamps taken here line up with the server process's.
 	"""
 
-	def __init__(self, hostport):
-		if ':' in hostport:
-			host,port = hostport.split(':',1)
-			port = int(port)
-		else:
-			host = hostport
-			port = DEFAULT_PORT
+	s = server()
+	s._config = config
+	s.load_handler(handler)
 
-		self._host = host
-		self._port = port
+	# Timings left when quitting aren't worth holding up the exit for
+	results.cancel_join_thread()
+	next_report = time.monotonic() + PROCESS_REPORT_INTERVAL
+	traces = []
 
-	def __enter__(self):
-		# Not much a context since UDP is stateless, but in case it is switched to TCP then already using a context manager is easy
-		return self
+	while True:
+		if time.monotonic() >= next_report:
+			next_report = time.monotonic() + PROCESS_REPORT_INTERVAL
+			h = s._metrics.handler.take()
+			if h[1]:
+				results.put( (h, s._metrics.errors.pop('handler', 0), traces) )
+				traces = []
 
-	def __exit__(self, exc_type, exc_value, traceback):
-		return False
+		try:
+			item = q.get(timeout=PROCESS_REPORT_INTERVAL)
+		except queue.Empty:
+			continue
+		except KeyboardInterrupt:
+			# Ctrl-C goes to the whole process group, let the parent tell us when to quit
+			continue
+		if item is None:
+			return
+
+		queued_at,client,packet,trace = item
+		wait = time.monotonic() - queued_at
+		if trace is not None:
+			trace[5] = time.monotonic()
+		try:
+			s._run_handler(client, packet)
+			err = 0
+		except Exception as e:
+			print("Handler exception in process %d: %s(%s)" % (index, str(type(e)), e.args))
+			err = 1
+		if trace is not None:
+			trace[6] = time.monotonic()
+			traces.append(trace)
+
+		with counters.get_lock():
+			counters[0] += 1
+			counters[1] += err
+			counters[2] += wait
+			counters[3] = max(counters[3], wait)
+
+class processdispatcher:
+	"""
+	Same as dispatcher but the handler is imported and run in worker processes to get around the GIL for CPU heavy handlers.
+	Each process has its own bounded queue and packets are routed by sensor_key() so packets from one sensor are always
+	handled by the same process, in the order received.
+
+	@config is the server configuration given to the handler's server object in each process.
+	@handler is the handler module name, it is imported in each process.
+	@processes is the number of worker processes.
+	@size is the maximum number of packets that can be waiting in each process's queue.
+	"""
 
-	def write(self, data):
+	def __init__(self, config, handler, processes, size):
+		self._config = config
+		self._handler = handler
+		self._processes = processes
+		self._size = size
+		self._queues = []
+		self._counters = []
+		self._procs = []
+		self._lock = threading.Lock()
+		# Handler timings and errors sent back by the processes, see collect()
+		self._results = None
+
+		self.queued = 0
+		self.dropped = 0
+		self.max_depth = 0
+
+	def start(self):
 		"""
-		Write a request and read the response.
-		@data is a python object that is serialized as JSON and UTF-8 encoded.
-		The response is likewise assumed to be UTF-8 encoded JSON and returned as a python object.
+		Start the worker processes.
+		"""
+
+		self._results = multiprocessing.Queue()
+		for i in range(self._processes):
+			q = multiprocessing.Queue(maxsize=self._size)
+			counters = multiprocessing.Array('d', 4)
+			p = multiprocessing.Process(target=_process_worker, args=(i, self._config, self._handler, q, counters, self._results), name="pyrtl433net-worker-%d" % i, daemon=True)
+			p.start()
+
+			self._queues.append(q)
+			self._counters.append(counters)
+			self._procs.append(p)
+
+	def stop(self):
+		"""
+		Let the processes finish what is queued and wait for them to quit.
+		"""
+
+		for q in self._queues:
+			q.put(None)
+		for p in self._procs:
+			p.join()
+
+		self._queues = []
+		self._procs = []
+
+	def submit(self, client, packet, trace=None):
+		"""
+		Queue @packet from @client for the worker process that handles its sensor, with its @trace if it is traced.
+		Returns False if that queue is full and the packet was dropped.
 		"""
-		print("Sending to %s:%d: %s" % (self._host,self._port, data))
 
-		s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		s.settimeout(1.0)
+		# crc32 instead of hash() as hash() of a str is randomized per process
+		idx = zlib.crc32(repr(sensor_key(packet)).encode('utf-8')) % self._processes
+		q = self._queues[idx]
+
 		try:
-			s.sendto(json.dumps(data).encode('utf-8'), (self._host,self._port))
-			ret = s.recv(1024*10)
-		except socket.timeout:
-			# Sever may be down? Move along
-			return None
-		except OSError:
-			# Can be a "OSError: [Errno 101] Network is unreachable"
-			return None
+			q.put_nowait( (time.monotonic(), client, packet, trace) )
+		except queue.Full:
+			with self._lock:
+				self.dropped += 1
+			return False
+
+		with self._lock:
+			self.queued += 1
+			self.max_depth = max(self.max_depth, self._qsize(q))
+		return True
+
+	def collect(self, m, t):
+		"""
+		Add the handler timings and errors the processes sent back to metrics @m, and finish the traces they sent back in tracer @t.
+		"""
+
+		if self._results is None:
+			return
+
+		while True:
+			try:
+				h,errors,traces = self._results.get_nowait()
+			except queue.Empty:
+				return
+			m.handler.merge(*h)
+			if errors:
+				m.error('handler', errors)
+			for trace in traces:
+				t.finish(trace)
 
+	@staticmethod
+	def _qsize(q):
 		try:
-			ret = ret.decode('utf-8')
-			ret = json.loads(ret)
-			return ret
-		except:
-			# Random parsting error, probably junk packet then
-			return None
+			return q.qsize()
+		except NotImplementedError:
+			# Not available on all platforms (eg, macOS)
+			return 0
 
-	def getconfig(self):
+	def stats(self):
 		"""
-		Poll the server for configuration information.
+		Return a dictionary of the queue depth, drop counts, and time spent waiting in the queue summed across the processes.
 		"""
 
-		req = {
-			'cmd': 'getconfig',
-		}
-		# Keep looping until config is read
-		while True:
-			ret = self.write(req)
-			if ret is None:
-				print("No server found, retrying...")
-				time.sleep(1.0)
-				continue
+		handled = errors = wait_total = wait_max = 0
+		depths = []
+		for q,counters in zip(self._queues, self._counters):
+			with counters.get_lock():
+				handled += int(counters[0])
+				errors += int(counters[1])
+				wait_total += counters[2]
+				wait_max = max(wait_max, counters[3])
+			depths.append(self._qsize(q))
+
+		with self._lock:
+			return {
+				'processes': self._processes,
+				'depth': sum(depths),
+				'depths': depths,
+				'max_depth': self.max_depth,
+				'queued': self.queued,
+				'dropped': self.dropped,
+				'handled': handled,
+				'errors': errors,
+				'wait_avg': wait_total / handled if handled else 0.0,
+				'wait_max': wait_max,
+			}
+
+def fingerprint(packet, ignore):
+	"""
+	Return a hash of the contents of @packet, leaving out the fields in @ignore.
+	Copies of one transmission heard by different radios differ only in per-radio fields (rssi, snr, time, etc) so
+	leaving those out gives every copy the same fingerprint.
+	"""
 
-			elif 'error' in ret:
-				raise Exception("Response error: %s" % ret['error'])
-			elif 'exception' in ret:
-				raise Exception("Server exception: %s(%s)" % ret['exception'])
+	return hash(json.dumps({k:v for k,v in packet.items() if k not in ignore}, sort_keys=True))
 
-			break
+class deduplicator:
+	"""
+	Drops packets that were already seen within @window seconds, such as the same transmission heard by several radios
+	or repeated by the sensor.
 
-		return ret['config']
+	Fingerprints are kept in a dictionary (for O(1) lookup) pointing to one of a queue of time buckets, each bucket
+	spanning 1/@buckets of the window. Whole buckets older than the window are evicted at once.
+	A fingerprint is not refreshed when a duplicate is seen, so a sensor sending the same values over and over is
+	still passed through once per window.
 
-	def sendpacket(self, packet):
+	@ignore is the collection of packet fields left out of the fingerprint, DEDUP_ADDED_FIELDS are always left out too.
+	"""
+
+	def __init__(self, window=DEFAULT_DEDUP_WINDOW, ignore=DEFAULT_DEDUP_IGNORE, buckets=8):
+		self.window = window
+		self.ignore = frozenset(ignore).union(DEDUP_ADDED_FIELDS)
+		self._width = window / buckets
+
+		# fingerprint -> bucket number
+		self._index = {}
+		# Queue of (bucket number, [fingerprints])
+		self._buckets = collections.deque()
+
+		self.unique = 0
+		self.duplicates = 0
+
+	def _evict(self, now):
 		"""
-		Send a radio packet to the server.
+		Drop buckets that ended more than the window ago.
 		"""
 
-		req = {
-			'cmd': 'packet',
-			'packet': packet,
-		}
-		ret = self.write(req)
-		if ret is None:
-			print("No data received, server down?")
+		oldest = int((now - self.window) // self._width)
+		while len(self._buckets) and self._buckets[0][0] < oldest:
+			_,fps = self._buckets.popleft()
+			for fp in fps:
+				del self._index[fp]
+
+	def check(self, packet, now=None):
+		"""
+		Returns the fingerprint of @packet, or None if it is a duplicate.
+		A unique packet is not remembered until add() is called, so a packet that could not be delivered is not
+		mistaken for a duplicate when it is sent again.
+		"""
+
+		if now is None:
+			now = time.monotonic()
+		self._evict(now)
+
+		fp = fingerprint(packet, self.ignore)
+		if fp in self._index:
+			self.duplicates += 1
 			return None
-		elif 'error' in ret:
-			raise Exception("Response error: %s" % ret['error'])
-		elif 'exception' in ret:
-			raise Exception("Server exception: %s(%s)" % ret['exception'])
+		return fp
+
+	def add(self, fp, now=None):
+		"""
+		Remember fingerprint @fp from check() as seen at @now.
+		"""
 
-		# TODO: return something if the configuration changed
+		if now is None:
+			now = time.monotonic()
 
-		# Nothing back from the server, return empty dictionary (different from None)
-		return {}
+		b = int(now // self._width)
+		if not len(self._buckets) or self._buckets[-1][0] != b:
+			self._buckets.append( (b, []) )
+		self._buckets[-1][1].append(fp)
+		self._index[fp] = b
+		self.unique += 1
 
-	@staticmethod
-	def config_to_args(cfg):
+	def stats(self):
 		"""
-		Convert a server.cfg INI style configuration file into python dictionary object tree.
+		Return a dictionary of the number of fingerprints held and packets passed and dropped.
 		"""
 
-		opts = []
+		return {
+			'entries': len(self._index),
+			'unique': self.unique,
+			'duplicates': self.duplicates,
+		}
+
+class aggregator:
+	"""
+	Merges the copies of a transmission heard by different radios into one packet.
+	The first copy opens a @window second window, copies that arrive within it are merged, and when it closes a single
+	packet is passed on: the copy with the best rssi plus an observations list of [client, rssi, snr] for every copy.
+	Copies from a client with several radios have the radio tag added to their observation.
+	The packet's ts is that of the copy heard first, so transmissions are in the order they were sent.
+
+	At most @pending transmissions are held, if more arrive then the oldest is passed on early.
+	Copies straggling in after their window closed are dropped for another window.
+
+	@ignore is the collection of packet fields left out of the fingerprint, DEDUP_ADDED_FIELDS are always left out too.
+	"""
 
-		if 'frequency' in cfg:
+	def __init__(self, window=DEFAULT_AGGREGATE_WINDOW, ignore=DEFAULT_DEDUP_IGNORE, pending=DEFAULT_AGGREGATE_PENDING):
+		self.window = window
+		self.ignore = frozenset(ignore).union(DEDUP_ADDED_FIELDS)
+		self._max = pending
+
+		# fingerprint -> [client, best packet, best rssi, observations, earliest ts]
+		self._pending = {}
+		# Queue of (deadline, fingerprint), deadlines are in order since the window is the same for all
+		self._order = collections.deque()
+
+		# Transmissions already passed on, to drop stragglers
+		self._done = deduplicator(window, ignore)
+
+		self.events = 0
+		self.merged = 0
+		self.late = 0
+		self.evicted = 0
+		self.dropped = 0
+
+	def add(self, client, packet, now=None):
+		"""
+		Add @packet received from @client.
+		"""
+
+		if now is None:
+			now = time.monotonic()
+
+		fp = fingerprint(packet, self.ignore)
+		rssi = packet.get('rssi')
+		obs = [client, rssi, packet.get('snr')]
+		if 'radio' in packet:
+			obs.append(packet['radio'])
+
+		ts = packet.get('ts')
+		ent = self._pending.get(fp)
+		if ent is not None:
+			self.merged += 1
+			ent[3].append(obs)
+			if rssi is not None and (ent[2] is None or rssi > ent[2]):
+				ent[0] = client
+				ent[1] = packet
+				ent[2] = rssi
+			if ts is not None and (ent[4] is None or ts < ent[4]):
+				ent[4] = ts
+			return
+
+		# Straggler from a transmission that was already passed on
+		if self._done.check(packet, now) is None:
+			self.late += 1
+			return
+
+		self._pending[fp] = [client, packet, rssi, [obs], ts]
+		self._order.append( (now + self.window, fp) )
+
+	def expired(self, now=None):
+		"""
+		Return a list of (client, packet) for the transmissions whose window closed, or that were evicted to stay
+		within the pending limit.
+		"""
+
+		if now is None:
+			now = time.monotonic()
+
+		ret = []
+		while len(self._order) and (self._order[0][0] <= now or len(self._pending) > self._max):
+			deadline,fp = self._order.popleft()
+			if deadline > now:
+				self.evicted += 1
+
+			client,packet,_,obs,ts = self._pending.pop(fp)
+			self._done.add(fp, now)
+
+			packet = dict(packet)
+			packet['observations'] = obs
+			if ts is not None:
+				packet['ts'] = ts
+			ret.append( (client, packet) )
+			self.events += 1
+
+		return ret
+
+	def stats(self):
+		"""
+		Return a dictionary of counts of transmissions held, passed on, copies merged, and copies dropped.
+		"""
+
+		return {
+			'pending': len(self._pending),
+			'events': self.events,
+			'merged': self.merged,
+			'late': self.late,
+			'evicted': self.evicted,
+			'dropped': self.dropped,
+		}
+
+class seqwindow:
+	"""
+	Tracks which request seq numbers were recently handled for each client session, so a request repeated because its
+	response was lost is acknowledged without handling its packets again.
+
+	For each session this is the highest seq seen and a bitmask of which of the @size seq numbers below it were seen.
+	Only the @sessions most recently active sessions are kept.
+	"""
+
+	def __init__(self, size=DEFAULT_SEQ_WINDOW, sessions=DEFAULT_MAX_SESSIONS):
+		self._size = size
+		self._mask = (1 << size) - 1
+		self._max = sessions
+
+		# session -> [highest seq, bitmask where bit N is highest-N]
+		self._sessions = collections.OrderedDict()
+
+		self.suppressed = 0
+		self.suppressed_packets = 0
+
+	def seen(self, session, seq):
+		"""
+		Returns True if @seq was already handled for @session.
+		A seq too old to be in the window is assumed to have been handled.
+		"""
+
+		ent = self._sessions.get(session)
+		if ent is None:
+			return False
+
+		high,mask = ent
+		if seq > high:
+			return False
+
+		off = high - seq
+		if off >= self._size:
+			return True
+		return bool((mask >> off) & 1)
+
+	def add(self, session, seq):
+		"""
+		Mark @seq handled for @session.
+		"""
+
+		ent = self._sessions.get(session)
+		if ent is None:
+			self._sessions[session] = [seq, 1]
+			if len(self._sessions) > self._max:
+				# Forget the least recently active session
+				self._sessions.popitem(last=False)
+			return
+
+		self._sessions.move_to_end(session)
+		high,mask = ent
+		if seq > high:
+			ent[0] = seq
+			ent[1] = ((mask << (seq - high)) | 1) & self._mask
+		elif high - seq < self._size:
+			ent[1] = mask | (1 << (high - seq))
+
+	def stats(self):
+		"""
+		Return a dictionary of the number of sessions tracked and the repeats suppressed.
+		"""
+
+		return {
+			'sessions': len(self._sessions),
+			'suppressed': self.suppressed,
+			'suppressed_packets': self.suppressed_packets,
+		}
+
+class deltastore:
+	"""
+	Recent packets from each client session, so a client in delta mode can send only the fields that changed since a
+	packet the server already has.
+
+	A packet in delta mode has a _v version number given by the client, and a delta also has _b, the version of the packet
+	it is based on, and _d, a list of fields removed since then. The other fields are the ones that changed.
+	For each session the last @versions packets of each sensor are kept, only the @sessions most recently active sessions are kept.
+	"""
+
+	def __init__(self, versions=DEFAULT_DELTA_VERSIONS, sessions=DEFAULT_MAX_SESSIONS):
+		self._versions = versions
+		self._max = sessions
+
+		# session -> [{version: packet}, {sensor_key: deque of versions}]
+		self._sessions = collections.OrderedDict()
+
+		self.full = 0
+		self.deltas = 0
+		self.resyncs = 0
+
+	def rebuild(self, session, packet):
+		"""
+		Return the full packet for @packet from @session, either a full packet or a delta, and remember it for later deltas.
+		Returns None if the packet a delta is based on is not known (eg, the server restarted), then the client has to resync.
+		"""
+
+		packet = dict(packet)
+		ver = packet.pop('_v')
+		base = packet.pop('_b', None)
+		dels = packet.pop('_d', ())
+
+		ent = self._sessions.get(session)
+		if base is not None:
+			if ent is None or base not in ent[0]:
+				self.resyncs += 1
+				return None
+
+			full = dict(ent[0][base])
+			full.update(packet)
+			for k in dels:
+				full.pop(k, None)
+			packet = full
+			self.deltas += 1
+		else:
+			self.full += 1
+
+		if ent is None:
+			ent = self._sessions[session] = [{}, {}]
+			if len(self._sessions) > self._max:
+				# Forget the least recently active session
+				self._sessions.popitem(last=False)
+		else:
+			self._sessions.move_to_end(session)
+
+		packets,sensors = ent
+		vers = sensors.get(sensor_key(packet))
+		if vers is None:
+			vers = sensors[sensor_key(packet)] = collections.deque()
+		if ver not in packets:
+			vers.append(ver)
+			if len(vers) > self._versions:
+				del packets[vers.popleft()]
+		packets[ver] = packet
+
+		return packet
+
+	def stats(self):
+		"""
+		Return a dictionary of the number of sessions tracked, full packets and deltas received, and resyncs asked for.
+		"""
+
+		return {
+			'sessions': len(self._sessions),
+			'full': self.full,
+			'deltas': self.deltas,
+			'resyncs': self.resyncs,
+		}
+
+class histogram:
+	"""
+	HDR-style histogram of durations in seconds.
+	Values are kept as microseconds in buckets that are exact to @bits significant bits (about 3% with the default),
+	so recording is cheap at any rate and percentiles are within that error however long it runs.
+	"""
+
+	def __init__(self, bits=5):
+		self._bits = bits
+		self._lock = threading.Lock()
+
+		# Bucket lower bound in microseconds -> count
+		self._counts = {}
+
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def record(self, seconds):
+		"""
+		Add a duration of @seconds.
+		"""
+
+		v = max(int(seconds * 1000000), 0)
+		shift = max(v.bit_length() - self._bits, 0)
+		v = (v >> shift) << shift
+
+		with self._lock:
+			self._counts[v] = self._counts.get(v, 0) + 1
+			self.count += 1
+			self.total += seconds
+			self.max = max(self.max, seconds)
+
+	def take(self):
+		"""
+		Return (buckets, count, total, max) of what was recorded and start over, for merge() into another histogram.
+		"""
+
+		with self._lock:
+			ret = (self._counts, self.count, self.total, self.max)
+			self._counts = {}
+			self.count = 0
+			self.total = 0.0
+			self.max = 0.0
+		return ret
+
+	def merge(self, counts, count, total, max_):
+		"""
+		Add @counts, @count, @total, and @max_ taken from a histogram with the same bits (eg, in a worker process).
+		"""
+
+		with self._lock:
+			for v,n in counts.items():
+				self._counts[v] = self._counts.get(v, 0) + n
+			self.count += count
+			self.total += total
+			self.max = max(self.max, max_)
+
+	def percentiles(self, ps=(50, 90, 99, 99.9)):
+		"""
+		Return a list of the durations in seconds at percentiles @ps, the highest value of the bucket each falls in.
+		"""
+
+		with self._lock:
+			buckets = sorted(self._counts.items())
+			count = self.count
+
+		ret = []
+		for p in ps:
+			if not count:
+				ret.append(0.0)
+				continue
+
+			target = max(math.ceil(count * p / 100), 1)
+			cum = 0
+			for v,n in buckets:
+				cum += n
+				if cum >= target:
+					break
+			shift = max(v.bit_length() - self._bits, 0)
+			ret.append((v + (1 << shift) - 1) / 1000000)
+		return ret
+
+	def stats(self):
+		"""
+		Return a dictionary of the count, mean, max, and the 50th, 90th, 99th, and 99.9th percentiles.
+		"""
+
+		p50,p90,p99,p999 = self.percentiles()
+		with self._lock:
+			return {
+				'count': self.count,
+				'mean': self.total / self.count if self.count else 0.0,
+				'max': self.max,
+				'p50': p50,
+				'p90': p90,
+				'p99': p99,
+				'p999': p999,
+			}
+
+class metrics:
+	"""
+	Registry of server metrics: requests, packets, and bytes from each client, histograms of the time spent decoding
+	requests and in rtl433_handler, and counts of errors by kind (exception, error, busy, resync, decode, handler).
+	It is updated from the engines, worker threads, and asyncio tasks so everything is under a lock.
+	Only the @clients most recently active clients are kept.
+	"""
+
+	def __init__(self, clients=DEFAULT_MAX_SESSIONS):
+		self._max = clients
+		self._lock = threading.Lock()
+
+		# client_address -> [first seen, requests, packets, bytes]
+		self._clients = collections.OrderedDict()
+		self.errors = collections.Counter()
+
+		self.decode = histogram()
+		self.handler = histogram()
+
+		self.started = time.time()
+
+	def _client(self, client_address):
+		ent = self._clients.get(client_address)
+		if ent is None:
+			ent = self._clients[client_address] = [time.time(), 0, 0, 0]
+			if len(self._clients) > self._max:
+				# Forget the least recently active client
+				self._clients.popitem(last=False)
+		else:
+			self._clients.move_to_end(client_address)
+		return ent
+
+	def request(self, client_address, nbytes):
+		"""
+		Count a request of @nbytes from @client_address.
+		"""
+
+		with self._lock:
+			ent = self._client(client_address)
+			ent[1] += 1
+			ent[3] += nbytes
+
+	def packets(self, client_address, n):
+		"""
+		Count @n packets from @client_address.
+		"""
+
+		with self._lock:
+			self._client(client_address)[2] += n
+
+	def error(self, kind, n=1):
+		"""
+		Count @n errors of @kind.
+		"""
+
+		with self._lock:
+			self.errors[kind] += n
+
+	def stats(self):
+		"""
+		Return a dictionary of the uptime, per client counts and packet rates, histograms, and error counts.
+		"""
+
+		now = time.time()
+		with self._lock:
+			clients = {
+				"%s:%d" % k[:2]: {
+					'requests': v[1],
+					'packets': v[2],
+					'bytes': v[3],
+					'packet_rate': v[2] / max(now - v[0], 1.0),
+				}
+				for k,v in self._clients.items()
+			}
+			errors = dict(self.errors)
+
+		return {
+			'uptime': now - self.started,
+			'clients': clients,
+			'decode': self.decode.stats(),
+			'handler': self.handler.stats(),
+			'errors': errors,
+		}
+
+class tracer:
+	"""
+	End-to-end latency of packets from clients that trace (--trace), broken into stages:
+		client is from the line being read from rtl_433 until the request with it is sent
+		network is from the request being sent until the server receives it
+		server is from being received until it is dispatched (decoding, delta, de-duplication)
+		queue is from being dispatched until the handler starts
+		handler is how long rtl433_handler ran
+		total is from the line being read until the handler is done
+
+	Client stamps are on the client's clock and are moved to the server's with the clock offset the client measured,
+	or if it hasn't then with the smallest difference seen between when a request was sent and when it was received.
+	In that case network is the delay beyond the quickest request seen rather than the one-way delay.
+	Passthrough (--raw) requests have no send stamp, so client is counted in network.
+	Only sessions that asked for it in getconfig are traced.
+
+	A trace is a list of [client_address, read, sent, received, dispatched, started, done] in server time, None for
+	stages it didn't get to. The last @events finished traces are kept for export as Chrome trace-event JSON.
+	"""
+
+	STAGES = ('client', 'network', 'server', 'queue', 'handler', 'total')
+
+	def __init__(self, events=DEFAULT_TRACE_EVENTS, sessions=DEFAULT_MAX_SESSIONS):
+		self._max = sessions
+		self._lock = threading.Lock()
+
+		# Traced session -> smallest (received - sent) seen, None until the first
+		self._offsets = collections.OrderedDict()
+
+		self.stages = {_: histogram() for _ in __class__.STAGES}
+		self._traces = collections.deque(maxlen=events)
+		# Traces finished since the last export
+		self._new = 0
+
+		self.traced = 0
+
+	def enable(self, session):
+		"""
+		Trace packets from @session.
+		"""
+
+		with self._lock:
+			if session not in self._offsets:
+				self._offsets[session] = None
+				if len(self._offsets) > self._max:
+					self._offsets.popitem(last=False)
+
+	def tracing(self, session):
+		"""
+		Returns True if packets from @session are traced.
+		"""
+
+		return session in self._offsets
+
+	def begin(self, session, client_address, read, sent, received, offset=None):
+		"""
+		Return the trace of a packet from @client_address that the client read at @read and sent at @sent (None if not known).
+		Both are client times, @received is the server time the request arrived.
+		@offset is what to add to client times to get server times, if it is None the smallest gap seen from @session is used.
+		"""
+
+		stamp = read if sent is None else sent
+		with self._lock:
+			least = self._offsets.get(session)
+			if least is None or received - stamp < least:
+				least = self._offsets[session] = received - stamp
+			self._offsets.move_to_end(session)
+		if offset is None:
+			offset = least
+
+		return [client_address, read + offset, None if sent is None else sent + offset, received, None, None, None]
+
+	def finish(self, trace):
+		"""
+		Record the stages of @trace, it goes no further.
+		"""
+
+		client_address,read,sent,received,dispatched,started,done = trace
+		for stage,a,b in (
+			('client', read, sent),
+			('network', read if sent is None else sent, received),
+			('server', received, dispatched),
+			('queue', dispatched, started),
+			('handler', started, done),
+			('total', read, done),
+		):
+			if a is not None and b is not None:
+				self.stages[stage].record(b - a)
+
+		with self._lock:
+			self.traced += 1
+			self._new += 1
+			self._traces.append(trace)
+
+	def stats(self):
+		"""
+		Return a dictionary of the packets traced, the sessions with an offset, and the histogram of each stage.
+		"""
+
+		return {
+			'traced': self.traced,
+			'sessions': len(self._offsets),
+			'stages': {k:v.stats() for k,v in self.stages.items()},
+		}
+
+	def export(self, fname):
+		"""
+		Write the kept traces to @fname as Chrome trace-event JSON (for chrome://tracing or Perfetto) if any finished since the last time.
+		Each packet is an async slice per client with its stages nested in it.
+		"""
+
+		with self._lock:
+			if not self._new:
+				return
+			self._new = 0
+			traces = list(self._traces)
+			first = self.traced - len(traces)
+
+		events = []
+		for i,trace in enumerate(traces, first):
+			client_address,read,sent,received,dispatched,started,done = trace
+			pid = "%s:%d" % client_address[:2]
+			stamps = [_ for _ in trace[1:] if _ is not None]
+
+			spans = [('packet', stamps[0], stamps[-1])]
+			for stage,a,b in (
+				('client', read, sent),
+				('network', read if sent is None else sent, received),
+				('server', received, dispatched),
+				('queue', dispatched, started),
+				('handler', started, done),
+			):
+				if a is not None and b is not None:
+					spans.append( (stage, a, b) )
+
+			for name,a,b in spans:
+				events.append({'name': name, 'cat': 'packet', 'ph': 'b', 'id': i, 'pid': pid, 'tid': 0, 'ts': a * 1000000})
+			for name,a,b in reversed(spans):
+				events.append({'name': name, 'cat': 'packet', 'ph': 'e', 'id': i, 'pid': pid, 'tid': 0, 'ts': b * 1000000})
+
+		# Replace the file in one go so a viewer never sees half of it
+		with open(fname + '.tmp', 'w') as f:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+		os.replace(fname + '.tmp', fname)
+
+class server:
+	"""
+	UDP and/or TCP server that listens for packets from the clients.
+	Transport layer is JSON encoded at UTF-8, or a codec negotiated in getconfig, and responses use the codec of the request.
+	Over TCP each message is prefixed with its length as a 4 byte big-endian integer.
+
+	Requests from clients contain and 'cmd' key:
+		getconfig returns the configuration parsed from the server.cfg
+		packet is a radio packet received at the client end
+		batch is a list of radio packets received at the client end, acknowledged together
+		report is statistics from the client (eg, its read queue), kept for server.stats()
+		stats returns server.stats()
+		clock does nothing, the response is a clock sample for clients whose packet requests don't get one (TCP and --raw)
+	A batch can also come as a rawcodec message of rtl_433 output lines, that are parsed here.
+	Packets can be delta encoded against earlier packets from the same sensor, see deltastore.
+
+	Two engines are available to receive the requests:
+		socketserver uses a blocking socketserver.UDPServer and handles each datagram one at a time
+		asyncio uses an asyncio datagram endpoint, coroutine handlers are scheduled as tasks so receiving continues while they run
+
+	Requests may have a seq number that is echoed back in the response.
+	Every response has the configuration version, when it changes clients should getconfig again.
+	Over TCP, packet and batch requests get no response unless there is an error, and a reload pushes {cmd=version}.
+	Requests may also have a session, a packet or batch request with a session and seq that was already handled is
+	acknowledged (with repeat=true) without delivering the packets again.
+
+	Returned is object of
+		ret=ok if the packet was received
+		ret=busy if the packet was refused because the dispatch queue is full, the client should send it again later
+			for a batch, accepted is the number of packets at the start of the batch that did get queued
+		ret=error if there was an error, and the error key is set with something meaningful
+		ret=exception if there was an exception of some kind with exception key as a two tuple (exception type name, exception string value)
+	"""
+
+	class _MyUDPServer(socketserver.UDPServer):
+		"""
+		UDP server that calls back to the pyrtl433net server for periodic work between requests.
+		"""
+
+		# Batches can be bigger than the default 8 KB
+		max_packet_size = MAX_DATAGRAM
+
+		def service_actions(self):
+			self._pyrtl433net._service()
+
+	class _MyUDPHandler(socketserver.BaseRequestHandler):
+		"""
+		Handler class for a UDP server.
+		"""
+
+		def handle(self):
+			# request is a 2 tuple of (data,socket)
+			data = self.request[0]
+			sock = self.request[1]
+
+			ret = self.server._pyrtl433net._request(data, self.client_address)
+			sock.sendto(ret, self.client_address)
+
+	class _MyUDPProtocol(asyncio.DatagramProtocol):
+		"""
+		Protocol class for the asyncio UDP server.
+		Same request/response handling as _MyUDPHandler but datagrams keep being received while coroutine handlers run.
+		"""
+
+		def __init__(self, server):
+			self.server = server
+			self.transport = None
+
+		def connection_made(self, transport):
+			self.transport = transport
+
+		def datagram_received(self, data, addr):
+			ret = self.server._request(data, addr)
+			self.transport.sendto(ret, addr)
+
+		def error_received(self, exc):
+			print("UDP error: %s" % exc)
+
+	def _request(self, data, client_address):
+		"""
+		Decode the request @data received from @client_address, handle it, and return the encoded response.
+		"""
+
+		# Respond in whatever codec the request came in
+		codec = jsoncodec
+		received = time.monotonic()
+		try:
+			codec,j = self._decode(data, client_address)
+		except Exception as e:
+			j = None
+			ret = self._respond_exception(e)
+		else:
+			ret = self._respond(j, client_address, received)
+
+		return codec.encode(ret)
+
+	def _decode(self, data, client_address):
+		"""
+		Decode request @data from @client_address, returns the codec to respond with and the request.
+		A compressed frame is decompressed first, and rtl_433 lines from a passthrough client become lazypacket's if lazy is on.
+		"""
+
+		self._metrics.request(client_address, len(data))
+		start = time.perf_counter()
+		try:
+			codec,j = self._decode_frame(data, client_address)
+		except Exception:
+			self._metrics.error('decode')
+			raise
+		self._metrics.decode.record(time.perf_counter() - start)
+		return codec,j
+
+	def _decode_frame(self, data, client_address):
+		codec = codec_for(data)
+		if codec is zlibcodec:
+			start = time.process_time()
+			dec = zlibcodec.decompress(data)
+			self._count_compression(client_address, len(data), len(dec), time.process_time() - start)
+			data = dec
+			codec = codec_for(data)
+
+		if codec is rawcodec and self._lazy:
+			return codec,codec.decode(data, lazypacket)
+		return codec,codec.decode(data)
+
+	def _report(self, client_address, stats):
+		"""
+		Keep the latest @stats reported by @client_address.
+		"""
+
+		if client_address not in self._reports and len(self._reports) >= DEFAULT_MAX_SESSIONS:
+			# Forget the client that was added first, it's likely gone
+			del self._reports[next(iter(self._reports))]
+		self._reports[client_address] = dict(stats, time=time.time())
+
+	def _count_compression(self, client_address, wire, frame, cpu):
+		"""
+		Add a compressed frame from @client_address of @wire bytes, @frame bytes decompressed, that took @cpu seconds.
+		"""
+
+		ent = self._compression.get(client_address)
+		if ent is None:
+			# Forget the client that was added first, it's likely gone
+			if len(self._compression) >= DEFAULT_MAX_SESSIONS:
+				del self._compression[next(iter(self._compression))]
+			ent = self._compression[client_address] = [0, 0, 0, 0.0]
+
+		ent[0] += 1
+		ent[1] += wire
+		ent[2] += frame
+		ent[3] += cpu
+
+	def _respond(self, j, client_address, received=None, retry=False):
+		"""
+		Handle decoded request @j, which arrived at monotonic time @received, and return the response.
+		If the request has a seq number, it is echoed in the response so the client can match responses to pipelined requests.
+		If it has the time it was sent, the response is a clock sample for the client, and the client's clock offset
+		and round trip time it measured from them come with later requests.
+		@retry is set when it is the same request again after a busy response, which isn't counted as another error.
+		"""
+
+		try:
+			if isinstance(j, dict) and 'clock' in j:
+				self._clock(j, client_address)
+			ret = self._handle(j, client_address, received)
+		except Exception as e:
+			ret = self._respond_exception(e)
+
+		if ret['ret'] != 'ok' and not (retry and ret['ret'] == 'busy'):
+			self._metrics.error(ret['ret'])
+
+		if isinstance(j, dict) and 'seq' in j:
+			ret['seq'] = j['seq']
+
+		if isinstance(j, dict) and 'sent' in j:
+			# Clock sample as in NTP: when the client sent the request, when it was received, and when it is answered
+			now = time.time()
+			t1 = now if received is None else received + now - time.monotonic()
+			ret['clock'] = [j['sent'], t1, now]
+
+		# Every response carries the configuration version so clients notice a reload
+		ret['version'] = self._config_version
+		return ret
+
+	def _clock(self, data, client_address):
+		"""
+		Keep the [offset, round trip time] the client measured that came with request @data from @client_address.
+		"""
+
+		session = data.get('session')
+		if session is None:
+			return
+
+		offset,rtt = data['clock']
+		self._clocks[session] = [client_address, float(offset), float(rtt)]
+		self._clocks.move_to_end(session)
+		if len(self._clocks) > DEFAULT_MAX_SESSIONS:
+			# Forget the least recently heard from session
+			self._clocks.popitem(last=False)
+
+	def _respond_exception(self, e):
+		return {"ret": "exception", "exception": (str(type(e)), e.args), "version": self._config_version}
+
+	def _handle(self, data, client_address, received=None):
+		"""
+		Actually handle the client data.
+		Executing/handling commands is done here regardless of which engine received the request.
+		"""
+
+		if data['cmd'] == 'getconfig':
+			ret = {"ret": "ok", 'config': self._config}
+
+			# Pick the client's most preferred codec that is enabled here, clients that don't offer any stay on JSON
+			for name in data.get('codecs', []):
+				if name in self._codecs:
+					ret['codec'] = name
+					break
+
+			# Let passthrough clients know they can send rtl_433 lines without parsing them
+			if data.get('raw'):
+				ret['raw'] = rawcodec.name
+
+			# Batches, delta encoding, and reports are always available
+			if data.get('batch'):
+				ret['batch'] = True
+			if data.get('delta'):
+				ret['delta'] = True
+			if data.get('report'):
+				ret['report'] = True
+			if data.get('trace'):
+				ret['trace'] = True
+				if 'session' in data:
+					self._tracer.enable(data['session'])
+
+			# Newest compression dictionary both have
+			zdicts = [_ for _ in data.get('zdicts', []) if _ in zlibcodec.ZDICTS]
+			if len(zdicts):
+				ret['zdict'] = max(zdicts)
+			return ret
+
+		elif data['cmd'] == 'packet':
+			return self._ingest(data, client_address, [data['packet']], received)
+
+		elif data['cmd'] == 'batch':
+			ret = self._ingest(data, client_address, data['packets'], received)
+			if ret['ret'] == 'ok':
+				ret['count'] = len(data['packets'])
+			return ret
+
+		elif data['cmd'] == 'report':
+			self._report(client_address, data['stats'])
+			return {"ret": "ok"}
+
+		elif data['cmd'] == 'stats':
+			return {"ret": "ok", "stats": self.stats()}
+
+		elif data['cmd'] == 'clock':
+			# Only here for the clock sample in the response
+			return {"ret": "ok"}
+
+		else:
+			print("Unknown command")
+			print(data)
+			return {"ret": 'error', "error": 'Unrecognized command'}
+
+	def _service(self):
+		"""
+		Periodic work called by the engines between requests, every SERVICE_INTERVAL seconds or so.
+		"""
+
+		if self._watch and time.monotonic() >= self._watch_next:
+			self._watch_next = time.monotonic() + WATCH_INTERVAL
+			try:
+				mtime = os.stat(self._fname).st_mtime
+			except OSError:
+				mtime = self._mtime
+			if mtime != self._mtime:
+				print("Configuration file %s changed" % self._fname)
+				self._reload_pending = True
+
+		if self._reload_pending:
+			self._reload_pending = False
+			self.reload()
+
+		if isinstance(self._dispatcher, processdispatcher):
+			self._dispatcher.collect(self._metrics, self._tracer)
+
+		if self._aggregator is not None:
+			for client,packet in self._aggregator.expired():
+				if not self._deliver(client, packet):
+					self._aggregator.dropped += 1
+
+		if self._trace_file is not None and time.monotonic() >= self._trace_next:
+			self._trace_next = time.monotonic() + TRACE_INTERVAL
+			self._tracer.export(self._trace_file)
+
+	def _ingest(self, data, client_address, packets, received=None):
+		"""
+		Deliver @packets from request @data, received at @received, in order.
+		If the request has a session and seq that was already handled, then it is a repeat because the response was lost
+		and the packets are not delivered again.
+		Delta encoded packets are rebuilt first, if one is based on a packet that isn't known then the client is told to resync.
+		Each packet gets a ts, the time in seconds since the epoch on the server's clock that the client read it, or that
+		the server received it if the client didn't say or hasn't measured its clock offset.
+		The client's stamp is taken off first, and is used to trace the packet if the client asked for it.
+		Only the packets taken in are counted, the rest are counted when the client repeats them.
+		"""
+
+		session = data.get('session')
+		seq = data.get('seq')
+		if session is not None and seq is not None and self._seqs.seen(session, seq):
+			self._seqs.suppressed += 1
+			self._seqs.suppressed_packets += len(packets)
+			return {"ret": "ok", "repeat": True}
+
+		# Client clock to server epoch, and server epoch to monotonic time
+		clock = self._clocks.get(session)
+		wall = time.time() - time.monotonic()
+		if received is None:
+			received = time.monotonic()
+
+		# Packets are delivered in order, if the queue fills then tell the client how many got in so it repeats the rest
+		for i,packet in enumerate(packets):
+			if '_v' in packet:
+				# Delta mode, base is remembered even if it isn't delivered as the client only uses acknowledged ones
+				packet = self._deltas.rebuild(session, packet)
+				if packet is None:
+					self._metrics.packets(client_address, i)
+					return {"ret": "resync", "accepted": i}
+
+			packet,read = self._untrace(packet)
+			if read is not None and clock is not None:
+				ts = read + clock[1]
+			else:
+				ts = received + wall
+			packet = self._stamp(packet, ts)
+
+			trace = None
+			if read is not None and self._tracer.tracing(session):
+				trace = self._tracer.begin(session, client_address, read, data.get('sent'), received, None if clock is None else clock[1] - wall)
+
+			if self._aggregator is not None:
+				# Delivered by _service() once the window closes
+				self._aggregator.add(client_address, packet)
+				continue
+
+			fp = None
+			if self._dedup is not None:
+				fp = self._dedup.check(packet)
+				if fp is None:
+					# Already seen from another radio
+					continue
+
+			if not self._deliver(client_address, packet, trace):
+				self._metrics.packets(client_address, i)
+				if data['cmd'] == 'batch':
+					return {"ret": "busy", "accepted": i}
+				return {"ret": "busy"}
+
+			if fp is not None:
+				self._dedup.add(fp)
+
+		self._metrics.packets(client_address, len(packets))
+
+		# Only remember it once everything is delivered, a partly delivered batch is repeated with the rest
+		if session is not None and seq is not None:
+			self._seqs.add(session, seq)
+
+		return {"ret": "ok"}
+
+	@staticmethod
+	def _untrace(packet):
+		"""
+		Return @packet and the _tr stamp of when the client read it, or None if it has none.
+		A lazypacket is returned without the stamp, a dict still has it until _stamp() replaces it.
+		"""
+
+		if isinstance(packet, lazypacket):
+			if not packet.raw.startswith(TRACE_PREFIX):
+				return packet,None
+			i = packet.raw.index(b',', len(TRACE_PREFIX))
+			return lazypacket(b'{' + packet.raw[i+1:]), float(packet.raw[len(TRACE_PREFIX):i])
+
+		return packet,packet.get('_tr')
+
+	@staticmethod
+	def _stamp(packet, ts):
+		"""
+		Return @packet with its ts field set to @ts, and without the _tr stamp from the client.
+		"""
+
+		if isinstance(packet, lazypacket):
+			return lazypacket(b'{"ts" : %.6f, ' % ts + packet.raw[1:])
+
+		packet = dict(packet)
+		packet.pop('_tr', None)
+		packet['ts'] = ts
+		return packet
+
+	def _deliver(self, client_address, packet, trace=None):
+		"""
+		Hand @packet off to rtl433_handler, either inline or through the dispatcher if workers are configured.
+		Returns False if the packet was dropped because the dispatch queue is full.
+		"""
+
+		if trace is not None:
+			trace[4] = time.monotonic()
+
+		if self._dispatcher is None:
+			self._call_handler(client_address, packet, trace)
+			return True
+
+		return self._dispatcher.submit(client_address, packet, trace)
+
+	def _run_handler(self, client_address, packet, trace=None):
+		"""
+		Invoke rtl433_handler for @packet and wait for it to finish, and finish its @trace if it is traced.
+		This is called from dispatcher worker threads, so a coroutine handler is run on the asyncio engine loop if it is running.
+		"""
+
+		if trace is not None:
+			trace[5] = time.monotonic()
+		start = time.perf_counter()
+		try:
+			if not self._handler_async:
+				self._handler.rtl433_handler(self, client_address, packet)
+
+			elif self._loop is not None:
+				asyncio.run_coroutine_threadsafe(self._handler.rtl433_handler(self, client_address, packet), self._loop).result()
+
+			else:
+				asyncio.run(self._handler.rtl433_handler(self, client_address, packet))
+		except Exception:
+			self._metrics.error('handler')
+			raise
+		finally:
+			self._metrics.handler.record(time.perf_counter() - start)
+			if trace is not None:
+				trace[6] = time.monotonic()
+				self._tracer.finish(trace)
+
+	def _call_handler(self, client_address, packet, trace=None):
+		"""
+		Invoke rtl433_handler for @packet received from @client_address.
+		A coroutine handler is scheduled as a task when the asyncio engine is running, otherwise it is run to completion.
+		"""
+
+		if self._handler_async and self._loop is not None:
+			if trace is not None:
+				trace[5] = time.monotonic()
+			start = time.perf_counter()
+			t = self._loop.create_task(self._handler.rtl433_handler(self, client_address, packet))
+			# Keep a reference to the task so it is not garbage collected while running
+			self._tasks.add(t)
+			t.add_done_callback(lambda t: self._task_done(t, start, trace))
+
+		else:
+			try:
+				self._run_handler(client_address, packet, trace)
+			except Exception as e:
+				# Counted already, the packet is still acknowledged so a failing handler doesn't hold up the client
+				print("Handler exception: %s(%s)" % (str(type(e)), e.args))
+
+	def _task_done(self, task, start, trace):
+		"""
+		Callback when a coroutine handler task that started at @start finishes, finishes its @trace if it is traced.
+		"""
+
+		self._metrics.handler.record(time.perf_counter() - start)
+		if trace is not None:
+			trace[6] = time.monotonic()
+			self._tracer.finish(trace)
+		self._tasks.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			self._metrics.error('handler')
+			e = task.exception()
+			print("Handler exception: %s(%s)" % (str(type(e)), e.args))
+
+	def __init__(self):
+		self._engine = DEFAULT_ENGINE
+		self._handler = None
+		self._handler_async = False
+
+		# Dispatch thread or process pool, None if handling inline
+		self._workers = 0
+		self._processes = 0
+		self._queue_size = DEFAULT_QUEUE_SIZE
+		self._dispatcher = None
+
+		# Set while the asyncio engine is running
+		self._loop = None
+		self._tasks = set()
+
+		# Transports to listen on and the connected TCP clients (writer -> codec of its last request)
+		self._transports = ['udp']
+		self._tcp_writers = {}
+
+		# Codecs offered to clients in getconfig, JSON requests are always understood
+		self._codecs = list(CODECS)
+
+		# Pass lazypacket's to the handler for passthrough clients
+		self._lazy = False
+
+		# Compressed frames per client, client_address -> [frames, wire bytes, decompressed bytes, cpu seconds]
+		self._compression = {}
+
+		# Latest statistics reported by each client
+		self._reports = {}
+
+		# Counts and timings, and where to serve them as Prometheus text, None for nowhere
+		self._metrics = metrics()
+		self._metrics_address = None
+
+		# Clock of each client session, session -> [client_address, offset, round trip time]
+		self._clocks = collections.OrderedDict()
+
+		# Latency of packets from clients that trace, and the file to export them to, None to not export
+		self._tracer = tracer()
+		self._trace_file = None
+		self._trace_next = 0.0
+
+		# Configuration reloading on SIGHUP or when the file changes
+		self._config = None
+		self._config_version = None
+		self._fname = None
+		self._mtime = None
+		self._watch = False
+		self._watch_next = 0.0
+		self._reload_pending = False
+
+		# Recently handled requests per client session
+		self._seqs = seqwindow()
+
+		# Packets that delta encoded packets from clients are based on
+		self._deltas = deltastore()
+
+		# Cross-radio duplicate suppression or aggregation, None if off
+		self._dedup = None
+		self._aggregator = None
+
+	def stats(self):
+		"""
+		Return a dictionary of server statistics.
+		"""
+
+		ret = {}
+		ret['metrics'] = self._metrics.stats()
+		ret['sessions'] = self._seqs.stats()
+		ret['delta'] = self._deltas.stats()
+		if len(self._clocks):
+			ret['clocks'] = {"%s:%d" % v[0][:2]: {'offset': v[1], 'rtt': v[2]} for v in list(self._clocks.values())}
+		if self._tracer.traced:
+			ret['trace'] = self._tracer.stats()
+		if self._dedup is not None:
+			ret['dedup'] = self._dedup.stats()
+		if self._aggregator is not None:
+			ret['aggregate'] = self._aggregator.stats()
+		if self._dispatcher is not None:
+			ret['dispatch'] = self._dispatcher.stats()
+		if len(self._reports):
+			ret['clients'] = {"%s:%d" % k[:2]: v for k,v in list(self._reports.items())}
+		if len(self._compression):
+			ret['compression'] = {
+				"%s:%d" % k[:2]: {
+					'frames': v[0],
+					'bytes': v[1],
+					'decompressed': v[2],
+					'ratio': v[2] / v[1],
+					'cpu': v[3],
+				}
+				for k,v in list(self._compression.items())
+			}
+		return ret
+
+	def prometheus(self):
+		"""
+		Return server.stats() as Prometheus text exposition format.
+		Histograms become summaries, and per client counts are labelled with the client address.
+		"""
+
+		st = self.stats()
+		m = st['metrics']
+		lines = []
+		def metric(name, kind, helptext, samples):
+			lines.append("# HELP pyrtl433net_%s %s" % (name, helptext))
+			lines.append("# TYPE pyrtl433net_%s %s" % (name, kind))
+			for suffix,labels,v in samples:
+				lbl = ",".join('%s="%s"' % kv for kv in labels)
+				lines.append("pyrtl433net_%s%s%s %r" % (name, suffix, "{%s}" % lbl if lbl else "", v))
+		def summary(name, helptext, h):
+			samples = [('', (('quantile', q),), h[p]) for q,p in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('0.999', 'p999'))]
+			samples.append( ('_sum', (), h['mean'] * h['count']) )
+			samples.append( ('_count', (), h['count']) )
+			metric(name, 'summary', helptext, samples)
+
+		metric('uptime_seconds', 'gauge', "Seconds since the server started", [('', (), m['uptime'])])
+		for k,helptext in (('requests', "Requests received"), ('packets', "Packets received"), ('bytes', "Request bytes received")):
+			metric('client_%s_total' % k, 'counter', helptext + " from each client", [('', (('client', c),), v[k]) for c,v in m['clients'].items()])
+
+		summary('decode_seconds', "Time spent decoding requests", m['decode'])
+		summary('handler_seconds', "Time spent in rtl433_handler", m['handler'])
+
+		if 'trace' in st:
+			for k,h in st['trace']['stages'].items():
+				summary('trace_%s_seconds' % k, "Latency of traced packets in the %s stage" % k, h)
+
+		metric('errors_total', 'counter', "Errors by kind", [('', (('kind', k),), v) for k,v in sorted(m['errors'].items())])
+		metric('sessions', 'gauge', "Client sessions tracked", [('', (), st['sessions']['sessions'])])
+		metric('suppressed_total', 'counter', "Repeated requests suppressed", [('', (), st['sessions']['suppressed'])])
+
+		if 'dispatch' in st:
+			d = st['dispatch']
+			metric('queue_depth', 'gauge', "Packets waiting for a handler worker", [('', (), d['depth'])])
+			metric('queue_max_depth', 'gauge', "Most packets seen waiting for a handler worker", [('', (), d['max_depth'])])
+			for k in ('queued', 'dropped', 'handled'):
+				metric('dispatch_%s_total' % k, 'counter', "Packets %s by the dispatcher" % k, [('', (), d[k])])
+
+		if 'dedup' in st:
+			metric('duplicates_total', 'counter', "Duplicate packets dropped", [('', (), st['dedup']['duplicates'])])
+
+		return "\n".join(lines) + "\n"
+
+	def _serve_metrics(self):
+		"""
+		Start an HTTP server in a daemon thread that answers GET /metrics with server.prometheus().
+		Returns the http.server instance so it can be shut down, or None if [server] metrics is not set.
+		"""
+
+		if self._metrics_address is None:
+			return None
+
+		srv = self
+		class handler(http.server.BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split('?')[0] != '/metrics':
+					self.send_error(404)
+					return
+
+				body = srv.prometheus().encode('utf8')
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, fmt, *args):
+				# Scrapes are too frequent to print
+				pass
+
+		h = http.server.ThreadingHTTPServer(self._metrics_address, handler)
+		h.daemon_threads = True
+		threading.Thread(target=h.serve_forever, name="pyrtl433net-metrics", daemon=True).start()
+		print("Serving metrics on http://%s:%d/metrics" % self._metrics_address)
+		return h
+
+	def load(self, fname):
+		"""
+		From @fname, load it in as a configuration file for the server.
+		Expected sections:
+			[server] contains interface and port to specify where to listen
+				engine is the server engine to use: socketserver (default) or asyncio
+				transport is a space-delimited list of udp (default) and tcp, tcp is always served by the asyncio engine
+				workers is the number of handler threads, 0 (default) calls the handler inline before acknowledging
+				processes is the number of handler processes, if set then the handler is imported in each process and workers is ignored
+				queue is the maximum number of packets waiting for a worker (or for each process) before new packets are refused
+				watch is yes to reload the configuration when the file changes, it is always reloaded on SIGHUP
+				codecs is a space-delimited list of wire codecs a client may negotiate, default is all of them (bin1 json)
+				lazy is yes to pass packets from passthrough (--raw) clients to the handler as a lazypacket that only
+				  decodes the fields looked at, instead of a dict
+				metrics is [HOST:]PORT to serve server.stats() as Prometheus text over HTTP, HOST defaults to 127.0.0.1
+				trace is a file to write packets traced by clients (--trace) to as Chrome trace-event JSON, every few seconds
+			[rtl433] contains frequency, metadata, and fsk
+				frequency is whatever is passed via -f to rtl_433 (eg, "915M" for 915 MHz)
+				metadata is what you want to pass to -M, space-delimited list will result in multiple -M arguments
+				fsk is what you want to pass to -Y for the FSK pulse detector mode, space-delimited list will result in multiple -Y arguments
+			[rtl433.devices] is optional and tunes each SDR of a client with several (see --device) differently
+				device=frequency where device is what is passed to -d (eg, 0) and frequency replaces the one in [rtl433]
+			[rtl433.decoders] contains 3 possible options
+				include is what decoders to include using -R, if "*" then all decoders are included
+				exclude is what decoders to exclude, by default this is none
+				key=value is custom generic decoders passed by -X where key is used as the decoder name and formed by "n=key,value"
+			[dedup] is optional and contains
+				mode is off (default), drop to only pass the first copy of a transmission to the handler, or aggregate
+				  to merge the copies heard by different radios into one packet
+				window is how many seconds a packet is remembered, default 2 for drop and 0.5 for aggregate
+				ignore is a space-delimited list of per-radio fields left out when comparing packets, ts and radio are always left out
+				pending is the most transmissions held by aggregate at once, default 10000
+
+		This is converted to a simple dictionary object tree and passed to the client when requested.
+		"""
+
+		c = configparser.ConfigParser()
+		c.read(fname)
+		if 'server' not in c.sections():
+			raise ValueError("Server config missing a [server] section")
+
+		self._fname = fname
+		self._mtime = os.stat(fname).st_mtime
+		self._watch = c.getboolean('server', 'watch', fallback=False)
+
+		self._iface = c.get('server', 'interface', fallback='0.0.0.0')
+		self._port = c.getint('server', 'port', fallback=DEFAULT_PORT)
+		self._engine = c.get('server', 'engine', fallback=DEFAULT_ENGINE)
+		self._transports = [_ for _ in c.get('server', 'transport', fallback='udp').split(' ') if len(_)]
+		for t in self._transports:
+			if t not in TRANSPORTS:
+				raise ValueError("Unknown transport '%s', expected one of: %s" % (t, ", ".join(TRANSPORTS)))
+		self._workers = c.getint('server', 'workers', fallback=0)
+		self._processes = c.getint('server', 'processes', fallback=0)
+		self._queue_size = c.getint('server', 'queue', fallback=DEFAULT_QUEUE_SIZE)
+		self._codecs = [_ for _ in c.get('server', 'codecs', fallback=' '.join(CODECS)).split(' ') if len(_)]
+		for name in self._codecs:
+			if name not in CODECS:
+				raise ValueError("Unknown codec '%s', expected one of: %s" % (name, ", ".join(CODECS)))
+		self._lazy = c.getboolean('server', 'lazy', fallback=False)
+
+		# Prometheus endpoint, on localhost unless an interface is given
+		m = c.get('server', 'metrics', fallback=None)
+		if m:
+			if ':' in m:
+				host,port = m.rsplit(':', 1)
+			else:
+				host,port = '127.0.0.1',m
+			self._metrics_address = (host, int(port))
+
+		self._trace_file = c.get('server', 'trace', fallback=None)
+
+		self._frequency = c.get('rtl433', 'frequency')
+		self._metadata = c.get('rtl433', 'metadata', fallback=None)
+		self._fsk = c.get('rtl433', 'fsk', fallback=None)
+
+		# Space-delimited list of options to pass
+		if len(self._metadata):
+			self._metadata = [_.strip() for _ in self._metadata.split(' ')]
+			self._metadata = [_ for _ in self._metadata if len(_)]
+
+		# Space-delimited list of options to pass
+		if len(self._fsk):
+			self._fsk = [_.strip() for _ in self._fsk.split(' ')]
+			self._fsk = [_ for _ in self._fsk if len(_)]
+
+		self._include = c.get('rtl433.decoders', 'include', fallback='*')
+		self._exclude = c.get('rtl433.decoders', 'exclude', fallback=None)
+		self._customs = []
+		for key in c['rtl433.decoders']:
+			if key in ('include', 'exclude'): continue
+
+			val = c['rtl433.decoders'][key]
+			self._customs.append( 'n=%s,%s' % (key,val) )
+
+		mode = c.get('dedup', 'mode', fallback='off')
+		ignore = c.get('dedup', 'ignore', fallback=None)
+		if ignore is None:
+			ignore = DEFAULT_DEDUP_IGNORE
+		else:
+			ignore = [_ for _ in ignore.split(' ') if len(_)]
+
+		if mode == 'drop':
+			window = c.getfloat('dedup', 'window', fallback=DEFAULT_DEDUP_WINDOW)
+			self._dedup = deduplicator(window, ignore)
+		elif mode == 'aggregate':
+			window = c.getfloat('dedup', 'window', fallback=DEFAULT_AGGREGATE_WINDOW)
+			pending = c.getint('dedup', 'pending', fallback=DEFAULT_AGGREGATE_PENDING)
+			self._aggregator = aggregator(window, ignore, pending)
+		elif mode != 'off':
+			raise ValueError("Unknown [dedup] mode '%s', expected off, drop, or aggregate" % mode)
+
+		self._config = {
+			'frequency': self._frequency,
+			'metadata': self._metadata,
+			'fsk': self._fsk,
+			'decoders': {
+				'include': self._include,
+				'exclude': self._exclude,
+				'customs': self._customs,
+			},
+		}
+		# Only present if set so the configuration version of existing configurations doesn't change
+		if c.has_section('rtl433.devices'):
+			self._config['devices'] = dict(c['rtl433.devices'])
+		self._config_version = config_hash(self._config)
+
+	def reload(self):
+		"""
+		Load the configuration file again and start handing out the new configuration.
+		Clients see the version change in the next response, getconfig again, and restart rtl_433.
+		Only the rtl_433 configuration changes, the [server] and [dedup] sections need a restart of the server.
+		"""
+
+		n = __class__()
+		try:
+			n.load(self._fname)
+		except Exception as e:
+			print("Configuration reload of %s failed, keeping the current one: %s(%s)" % (self._fname, str(type(e)), e.args))
+			# Don't keep trying until the file changes again
+			try:
+				self._mtime = os.stat(self._fname).st_mtime
+			except OSError:
+				pass
+			return False
+
+		self._mtime = n._mtime
+		if n._config_version == self._config_version:
+			print("Configuration reloaded, no change")
+			return True
+
+		self._config = n._config
+		self._config_version = n._config_version
+		print("Configuration reloaded, version %s" % self._config_version)
+		self._notify()
+		return True
+
+	def load_handler(self, name):
+		"""
+		Import the handler module @name and check that it has a properly formed rtl433_handler(server, client, packet).
+		The handler may be a plain function or an async def coroutine function.
+		"""
+
+		# Ensure the handler function is good
+		hand = importlib.import_module(name)
+		fname = 'rtl433_handler'
+		if fname not in dir(hand):
+			raise ValueError("Imported handler object does not have a function named %s()" % fname)
+
+		# Get function as an object
+		f = hand.rtl433_handler
+
+		# Reflect and get arguments
+		fargs = inspect.getfullargspec(f)
+		if len(fargs.args) != 3:
+			raise ValueError("Imported handler object has rtl433_handler() but does not take 3 positional arguments: %s" % str(fargs.args))
+
+		# Enforce argument names so they're in the right order
+		if fargs.args[0] != 'server': raise ValueError("Imported handler object has rtl433_handler(%s) but first argument is not 'server'" % ",".join(fargs.args))
+		if fargs.args[1] != 'client': raise ValueError("Imported handler object has rtl433_handler(%s) but second argument is not 'client'" % ",".join(fargs.args))
+		if fargs.args[2] != 'packet': raise ValueError("Imported handler object has rtl433_handler(%s) but third argument is not 'packet'" % ",".join(fargs.args))
+
+		self._handler = hand
+		self._handler_async = inspect.iscoroutinefunction(f)
+
+	def serve_forever(self, args):
+		"""
+		Basic server function to handle incoming packets from clients.
+		Bind to socket, listen, and handle the packets using the engine chosen by --engine or the [server] engine option.
+		"""
+
+		if args.handler is None:
+			raise Exception("Expect a handler to be provided with --handler")
+
+		self.load_handler(args.handler[0])
+
+		engine = self._engine
+		if getattr(args, 'engine', None):
+			engine = args.engine[0]
+		if engine not in ENGINES:
+			raise ValueError("Unknown server engine '%s', expected one of: %s" % (engine, ", ".join(ENGINES)))
+		if 'tcp' in self._transports and engine != 'asyncio':
+			print("TCP transport multiplexes clients with the asyncio engine, using it instead of %s" % engine)
+			engine = 'asyncio'
+
+		if self._processes > 0:
+			self._dispatcher = processdispatcher(self._config, args.handler[0], self._processes, self._queue_size)
+			self._dispatcher.start()
+			print("Dispatching to %d worker processes, queue size %d each" % (self._processes, self._queue_size))
+		elif self._workers > 0:
+			self._dispatcher = dispatcher(self._run_handler, self._workers, self._queue_size)
+			self._dispatcher.start()
+			print("Dispatching to %d worker threads, queue size %d" % (self._workers, self._queue_size))
+
+		# Reload at the next chance, not in the middle of a request
+		def hup(signum, frame):
+			self._reload_pending = True
+		if hasattr(signal, 'SIGHUP'):
+			signal.signal(signal.SIGHUP, hup)
+
+		httpd = self._serve_metrics()
+
+		try:
+			if engine == 'socketserver':
+				self._serve_socketserver()
+			elif engine == 'asyncio':
+				asyncio.run(self._serve_asyncio())
+		finally:
+			if httpd is not None:
+				httpd.shutdown()
+				httpd.server_close()
+			if self._trace_file is not None:
+				self._tracer.export(self._trace_file)
+			if self._dispatcher is not None:
+				self._dispatcher.stop()
+				self._dispatcher = None
+
+	def _serve_socketserver(self):
+		"""
+		Serve using a blocking socketserver.UDPServer, each datagram is handled one at a time by _MyUDPHandler.
+		"""
+
+		with __class__._MyUDPServer((self._iface, self._port), __class__._MyUDPHandler) as s:
+			print("Listening to UDP %s:%d" % (self._iface, self._port))
+
+			# Access self.server._pyrtl433net within _MyUDPHandler.handle
+			s._pyrtl433net = self
+
+			s.serve_forever(poll_interval=SERVICE_INTERVAL)
+
+	async def _serve_asyncio(self):
+		"""
+		Serve using an asyncio datagram endpoint with _MyUDPProtocol and/or an asyncio TCP server with _tcp_client.
+		Runs until cancelled.
+		"""
+
+		self._loop = asyncio.get_running_loop()
+
+		transport = None
+		if 'udp' in self._transports:
+			transport,protocol = await self._loop.create_datagram_endpoint(lambda: __class__._MyUDPProtocol(self), local_addr=(self._iface, self._port))
+			print("Listening to UDP %s:%d (asyncio)" % (self._iface, self._port))
+
+		tcp = None
+		if 'tcp' in self._transports:
+			tcp = await asyncio.start_server(self._tcp_client, self._iface, self._port)
+			print("Listening to TCP %s:%d (asyncio)" % (self._iface, self._port))
+
+		try:
+			while True:
+				await asyncio.sleep(SERVICE_INTERVAL)
+				self._service()
+		finally:
+			if transport is not None:
+				transport.close()
+			if tcp is not None:
+				tcp.close()
+			self._loop = None
+
+	async def _tcp_client(self, reader, writer):
+		"""
+		Handle one TCP client connection: read length-prefixed requests until the client goes away.
+		Packets are not acknowledged over TCP, only other requests (eg, getconfig) and errors get a response.
+		If the dispatch queue is full then reading stops until there is room, and TCP holds the client back.
+		"""
+
+		client_address = writer.get_extra_info('peername')[:2]
+		self._tcp_writers[writer] = jsoncodec
+		try:
+			while True:
+				try:
+					hdr = await reader.readexactly(FRAME_HEADER.size)
+				except asyncio.IncompleteReadError:
+					# Clean close between requests
+					return
+
+				n, = FRAME_HEADER.unpack(hdr)
+				if n > MAX_FRAME:
+					print("TCP client %s:%d sent a %d byte frame, dropping connection" % (client_address[0], client_address[1], n))
+					return
+				data = await reader.readexactly(n)
+				received = time.monotonic()
+
+				try:
+					codec,j = self._decode(data, client_address)
+				except Exception as e:
+					self._tcp_send(writer, self._respond_exception(e), self._tcp_writers[writer])
+					continue
+				self._tcp_writers[writer] = codec
+
+				# Only what is left of the request is tried again, so it is counted once
+				retry = False
+				while True:
+					ret = self._respond(j, client_address, received, retry)
+					if ret['ret'] != 'busy':
+						break
+					retry = True
+
+					if j['cmd'] == 'batch':
+						del j['packets'][:ret.get('accepted', 0)]
+					await asyncio.sleep(BUSY_BACKOFF)
+
+				if isinstance(j, dict) and j.get('cmd') in ('packet', 'batch') and ret['ret'] == 'ok':
+					continue
+
+				self._tcp_send(writer, ret, codec)
+				await writer.drain()
+
+		except (ConnectionError, asyncio.IncompleteReadError) as e:
+			print("TCP client %s:%d connection lost: %s" % (client_address[0], client_address[1], e))
+
+		finally:
+			self._tcp_writers.pop(writer, None)
+			writer.close()
+
+	@staticmethod
+	def _tcp_send(writer, ret, codec=jsoncodec):
+		"""
+		Write @ret as a length-prefixed frame to TCP client @writer, encoded with @codec.
+		"""
+
+		dat = codec.encode(ret)
+		writer.write(FRAME_HEADER.pack(len(dat)) + dat)
+
+	def _notify(self):
+		"""
+		Push the configuration version to every TCP client, since they don't get a response to packets that would carry it.
+		"""
+
+		for writer,codec in list(self._tcp_writers.items()):
+			try:
+				self._tcp_send(writer, {"cmd": "version", "version": self._config_version}, codec)
+			except Exception:
+				# Connection is going away, _tcp_client cleans up
+				pass
+
+class spool:
+	"""
+	Bounded on-disk ring buffer of records (bytes) that the client stores packets in while the server is unreachable.
+	The file at @path is memory mapped and is @size bytes including a small header, so it survives a client restart.
+	If a record does not fit then the oldest records are dropped to make room.
+	first is the position of the oldest record, the number of records removed since it was opened.
+
+	Header is magic, head (offset of the oldest record), tail (offset past the newest record), and the record count.
+	Offsets keep counting up and are taken modulo the data size, each record is a 4 byte length and the bytes.
+	"""
+
+	_HEADER = struct.Struct('<4sQQQ')
+	_LEN = struct.Struct('<I')
+	_MAGIC = b'PRS1'
+
+	def __init__(self, path, size=DEFAULT_SPOOL_SIZE):
+		if size <= self._HEADER.size + self._LEN.size:
+			raise ValueError("Spool size %d is too small" % size)
+
+		self.path = path
+		self._datasize = size - self._HEADER.size
+
+		fresh = not os.path.exists(path) or os.path.getsize(path) != size
+		self._f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+		if fresh:
+			self._f.truncate(size)
+		self._mm = mmap.mmap(self._f.fileno(), size)
+
+		magic,self._head,self._tail,self._count = self._HEADER.unpack_from(self._mm, 0)
+		if fresh or magic != self._MAGIC or self._tail - self._head > self._datasize:
+			# New file, different size, or junk so start empty
+			self._head = self._tail = self._count = 0
+			self._flush()
+
+		self.first = 0
+		self.dropped = 0
+
+	def close(self):
+		self._mm.flush()
+		self._mm.close()
+		self._f.close()
+
+	def __len__(self):
+		return self._count
+
+	def _flush(self):
+		self._HEADER.pack_into(self._mm, 0, self._MAGIC, self._head, self._tail, self._count)
+
+	def _write(self, off, dat):
+		"""
+		Write @dat at ring offset @off, wrapping around the end.
+		"""
+
+		pos = off % self._datasize
+		n = min(len(dat), self._datasize - pos)
+		base = self._HEADER.size
+		self._mm[base+pos:base+pos+n] = dat[:n]
+		if n < len(dat):
+			self._mm[base:base+len(dat)-n] = dat[n:]
+
+	def _read(self, off, n):
+		"""
+		Read @n bytes at ring offset @off, wrapping around the end.
+		"""
+
+		pos = off % self._datasize
+		k = min(n, self._datasize - pos)
+		base = self._HEADER.size
+		ret = self._mm[base+pos:base+pos+k]
+		if k < n:
+			ret += self._mm[base:base+n-k]
+		return ret
+
+	def append(self, dat):
+		"""
+		Append record @dat, dropping the oldest records if needed to make room.
+		"""
+
+		need = self._LEN.size + len(dat)
+		if need > self._datasize:
+			raise ValueError("Record of %d bytes does not fit in the spool" % len(dat))
+
+		while self._datasize - (self._tail - self._head) < need:
+			self._pop()
+			self.dropped += 1
+
+		self._write(self._tail, self._LEN.pack(len(dat)))
+		self._write(self._tail + self._LEN.size, dat)
+
+		# Header last so a crash mid-write leaves the record out rather than half written
+		self._tail += need
+		self._count += 1
+		self._flush()
+
+	def _pop(self):
+		n, = self._LEN.unpack(self._read(self._head, self._LEN.size))
+		self._head += self._LEN.size + n
+		self._count -= 1
+		self.first += 1
+
+	def peek(self, maxbytes):
+		"""
+		Return a list of the oldest records, without removing them, up to @maxbytes bytes in total (at least one).
+		"""
+
+		ret = []
+		off = self._head
+		total = 0
+		for i in range(self._count):
+			n, = self._LEN.unpack(self._read(off, self._LEN.size))
+			if len(ret) and total + n > maxbytes:
+				break
+			ret.append(self._read(off + self._LEN.size, n))
+			off += self._LEN.size + n
+			total += n
+		return ret
+
+	def consume(self, n, first=None):
+		"""
+		Remove the @n oldest records.
+		If @first is given then they are the @n records peek() returned when the oldest was at position @first, any of
+		them dropped since to make room are already gone and the records after them are kept.
+		"""
+
+		if first is not None:
+			n -= self.first - first
+		for i in range(max(min(n, self._count), 0)):
+			self._pop()
+		if self._count == 0:
+			self._head = self._tail = 0
+		self._flush()
+
+class memspool:
+	"""
+	Same as spool but held in memory, for when no spool file is given.
+	At most @count records are held, if more are appended then the oldest are dropped.
+	"""
+
+	def __init__(self, count=DEFAULT_BUFFER):
+		self.path = None
+		self._max = count
+		self._q = collections.deque()
+		self.first = 0
+		self.dropped = 0
+
+	def close(self):
+		pass
+
+	def __len__(self):
+		return len(self._q)
+
+	def append(self, dat):
+		"""
+		Append record @dat, dropping the oldest record if full.
+		"""
+
+		if len(self._q) >= self._max:
+			self._q.popleft()
+			self.first += 1
+			self.dropped += 1
+		self._q.append(dat)
+
+	def peek(self, maxbytes):
+		"""
+		Return a list of the oldest records, without removing them, up to @maxbytes bytes in total (at least one).
+		"""
+
+		ret = []
+		total = 0
+		for dat in self._q:
+			if len(ret) and total + len(dat) > maxbytes:
+				break
+			ret.append(dat)
+			total += len(dat)
+		return ret
+
+	def consume(self, n, first=None):
+		"""
+		Remove the @n oldest records, or the @n from position @first that are still there (see spool.consume()).
+		"""
+
+		if first is not None:
+			n -= self.first - first
+		for i in range(max(min(n, len(self._q)), 0)):
+			self._q.popleft()
+			self.first += 1
+
+class client:
+	"""
+	UDP or TCP client that sends packets to the server.
+	Transport layer is JSON encoded at UTF-8, or a more compact codec if both ends agree on one in getconfig.
+	Over TCP each message is prefixed with its length as a 4 byte big-endian integer.
+	Over TCP packets are not acknowledged, TCP takes care of delivery.
+
+	A single connected socket is used for all requests, the server is only resolved again after a failure.
+	Each request has a seq number; packets are pipelined so up to window requests are in flight at once.
+
+	rtl_433 configuration is pulled from the server over this protocol too.
+	"""
+
+	def __init__(self, hostport, batch_size=1, batch_latency=DEFAULT_BATCH_LATENCY, batch_bytes=DEFAULT_BATCH_BYTES, window=DEFAULT_WINDOW, timeout=1.0, retries=5, codecs=(jsoncodec.name,), raw=False, compress=False, delta=False, trace=False):
+		"""
+		@hostport is the server to connect to as HOST or HOST:PORT, prefix with tcp:// to use the TCP transport.
+		@batch_size is the most packets to gather in one batch request, 1 means no batching.
+		@batch_latency is the longest, in seconds, a packet is held waiting for the batch to fill.
+		@batch_bytes is the most bytes of packets to put in one batch so it fits in a single datagram.
+		@window is the most pipelined requests that can be waiting on a response, 1 is stop-and-wait.
+		@timeout is how long in seconds to wait for a response before sending the request again.
+		@retries is how many times a pipelined request is sent before giving up on the server.
+		@codecs is the codec names to offer the server, most preferred first; JSON is used if the server takes none of them.
+		@raw is True to forward rtl_433 output lines to the server without parsing them, if the server supports it.
+		@compress is True to compress packet requests with a zlib dictionary, if the server supports it.
+		@delta is True to send only the fields that changed since the last packet from the same sensor, if the server supports it.
+		@trace is True to stamp requests with when they are sent so the server can trace latency, if the server supports it.
+
+		Requests carry the time they were sent and responses carry the server's times, as in NTP, so the client measures
+		the offset of its clock from the server's and sends it along for the server to timestamp packets with.
+		"""
+
+		self._tcp = False
+		if hostport.startswith('tcp://'):
+			self._tcp = True
+			hostport = hostport[6:]
+		elif hostport.startswith('udp://'):
+			hostport = hostport[6:]
+
+		if ':' in hostport:
+			host,port = hostport.split(':',1)
+			port = int(port)
+		else:
+			host = hostport
+			port = DEFAULT_PORT
+
+		self._host = host
+		self._port = port
+
+		self.batch_size = batch_size
+		self.batch_latency = batch_latency
+		self.batch_bytes = batch_bytes
+
+		self.window = window
+		self.timeout = timeout
+		self.retries = retries
+
+		# Codec for requests, always JSON until the server picks one of these in getconfig
+		self.codecs = list(codecs)
+		self._codec = jsoncodec
+
+		# Passthrough of rtl_433 lines, raw is only True once the server said it takes them
+		self._raw_wanted = raw
+		self.raw = False
+
+		# Compression dictionary version the server agreed on, None to not compress
+		self._compress_wanted = compress
+		self.zdict = None
+		# Compressed requests: frames, encoded bytes, bytes sent, cpu seconds
+		self._compression = [0, 0, 0, 0.0]
+
+		# Delta encoding, delta is only True once the server said it takes them
+		self._delta_wanted = delta
+		self.delta = False
+		# Last packet of each sensor the server acknowledged, sensor_key -> (version, packet)
+		self._bases = {}
+		# Newest versions sent of each sensor, to tell if the server has already let go of a base, sensor_key -> deque
+		self._sent = {}
+		self._ver = 0
+		# TCP requests sent since the last response, kept to send the rest again on a resync, seq -> request
+		self._unacked = collections.OrderedDict()
+		# Full packets and deltas sent, and resyncs the server asked for
+		self._deltas = [0, 0, 0]
+
+		# Server takes batch requests, lists of packets are sent one at a time until it says so
+		self.batches = False
+		# Server takes report requests
+		self.reports = False
+
+		# Latency tracing, trace is only True once the server said it takes trace stamps
+		self._trace_wanted = trace
+		self.trace = False
+
+		# Offset of the server's clock from this one and round trip time in seconds, None until measured
+		# clock is only True once the server answered with a clock sample, recent (round trip, offset) samples are kept
+		self.clock = False
+		self.offset = None
+		self.rtt = None
+		self._clock_samples = collections.deque(maxlen=CLOCK_SAMPLES)
+
+		# Pending batch of packets
+		self._batch = []
+		self._batch_len = 0
+		self._batch_started = None
+
+		# Connected socket, None until the first request or after a failure so the server is resolved again
+		self._sock = None
+		# Partial frames read from a TCP connection
+		self._rbuf = bytearray()
+
+		# Requests are numbered within a random session so the server can spot repeats
+		self._session_bytes = os.urandom(8)
+		self._session = self._session_bytes.hex()
+		self._seq = 0
+
+		# Version of the last configuration fetched and the latest version the server reported in a response
+		self.config_version = None
+		self.server_version = None
+
+		# Pipelined requests waiting on a response, seq -> [request, retransmit deadline, tries, onack, onerror]
+		self._inflight = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._disconnect()
+		return False
+
+	def _connect(self):
+		"""
+		Return the connected socket, resolving the server and connecting if not already connected.
+		"""
+
+		if self._sock is None:
+			family,type_,proto,_,addr = socket.getaddrinfo(self._host, self._port, type=socket.SOCK_STREAM if self._tcp else socket.SOCK_DGRAM)[0]
+			s = socket.socket(family, type_, proto)
+			try:
+				if self._tcp:
+					s.settimeout(self.timeout)
+					s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				s.connect(addr)
+			except OSError:
+				s.close()
+				raise
+			self._sock = s
+			self._rbuf.clear()
+
+		return self._sock
+
+	def _disconnect(self):
+		"""
+		Close the socket so the next request resolves the server again.
+		"""
+
+		if self._sock is not None:
+			self._sock.close()
+			self._sock = None
+		self._rbuf.clear()
+
+		# Can't tell what the server got, so deltas start over from full packets
+		self._bases.clear()
+		self._unacked.clear()
+
+	def _nextseq(self):
+		self._seq += 1
+		return self._seq
+
+	def _send(self, dat):
+		"""
+		Send one request @dat (bytes), as a datagram or as a length-prefixed frame over TCP.
+		"""
+
+		s = self._connect()
+		if self._tcp:
+			# Server not reading holds this up (TCP flow control), give up well after a response would have timed out
+			s.settimeout(self.timeout * self.retries)
+			s.sendall(FRAME_HEADER.pack(len(dat)) + dat)
+		else:
+			s.send(dat)
+
+	def _recv(self, timeout):
+		"""
+		Receive one response (bytes), waiting up to @timeout seconds.
+		Raises socket.timeout, or BlockingIOError if @timeout is zero, when nothing is there.
+		"""
+
+		s = self._connect()
+		if not self._tcp:
+			s.settimeout(timeout)
+			return s.recv(MAX_DATAGRAM)
+
+		deadline = time.monotonic() + timeout
+		while True:
+			if len(self._rbuf) >= FRAME_HEADER.size:
+				n, = FRAME_HEADER.unpack_from(self._rbuf)
+				if len(self._rbuf) >= FRAME_HEADER.size + n:
+					dat = bytes(self._rbuf[FRAME_HEADER.size:FRAME_HEADER.size + n])
+					del self._rbuf[:FRAME_HEADER.size + n]
+					return dat
+
+			s.settimeout(max(deadline - time.monotonic(), 0.0))
+			dat = s.recv(65536)
+			if not len(dat):
+				raise ConnectionResetError("Server closed the connection")
+			self._rbuf += dat
+
+	@staticmethod
+	def _decode(dat):
+		"""
+		Decode a response, returns None if it can't be decoded.
+		"""
+
+		try:
+			ret = codec_for(dat).decode(dat)
+		except:
+			# Random parsting error, probably junk packet then
+			return None
+
+		if not isinstance(ret, dict):
+			return None
+		return ret
+
+	def write(self, data):
+		"""
+		Write a request and read the response.
+		@data is a python object that is encoded with the negotiated codec (JSON by default).
+		The response is decoded with whichever codec it is in and returned as a python object.
+		The request carries the time it is sent, so the response is a clock sample from a server that gives them.
+		Returns None if no response was received within the timeout.
+		"""
+		print("Sending to %s:%d: %s" % (self._host,self._port, data))
+
+		seq = self._nextseq()
+		try:
+			# Connect before taking the send time so resolving the server doesn't skew the clock sample
+			self._connect()
+			req = dict(data, session=self._session, seq=seq, sent=time.time())
+			self._send(self._codec.encode(req))
+
+			deadline = time.monotonic() + self.timeout
+			while True:
+				ret = self._decode(self._recv(max(deadline - time.monotonic(), 0.001)))
+
+				if ret is not None and self._tcp and ('cmd' in ret or ret.get('seq', seq) != seq):
+					# Notification pushed by a TCP server, or an answer about packets sent before this (eg, a resync)
+					self._push(ret)
+					continue
+
+				# Skip junk, the request itself (see _pump()), and late responses to earlier requests; a server without seq support answers in order
+				if ret is not None and 'ret' in ret and ret.get('seq', seq) == seq:
+					self.server_version = ret.get('version', self.server_version)
+					self._clocksample(ret)
+					self._answered(seq)
+					return ret
+
+		except socket.timeout:
+			# Sever may be down? Move along
+			self._disconnect()
+			return None
+		except OSError:
+			# Can be a "OSError: [Errno 101] Network is unreachable" or a refused connection
+			self._disconnect()
+			return None
+
+	def pipeline(self, dat, onack=None, onerror=None):
+		"""
+		Send @dat to the server without waiting for the response.
+		@dat is either a single packet or a list of packets sent as a batch, or one at a time if the server doesn't take batches.
+		@onack is called with no arguments once the server acknowledges it, or @onerror if the server answers with an error
+		(then nothing was delivered).
+		Up to window requests can be waiting on a response, this only blocks while the window is full.
+		Returns False if the server stopped responding (a request was sent retries times without a response),
+		then every request without a response, including this one, is returned by takeinflight().
+		"""
+
+		if isinstance(dat, list) and not self.batches:
+			return self._pipelineeach(dat, onack, onerror)
+
+		if isinstance(dat, list):
+			req = {'cmd': 'batch', 'packets': dat}
+		else:
+			req = {'cmd': 'packet', 'packet': dat}
+
+		if self.delta:
+			# Versions stay the same when the request is sent again, so the server keeps the packets it already has
+			n = len(dat) if isinstance(dat, list) else 1
+			req['vers'] = list(range(self._ver, self._ver + n))
+			self._ver += n
+
+		if self._tcp:
+			if not self._sendtcp(req, onack, onerror):
+				return False
+			return self._pump(False)
+
+		while len(self._inflight) >= self.window:
+			if not self._pump(True):
+				# Not sent, but track it so takeinflight() returns it
+				self._inflight[self._nextseq()] = [req, time.monotonic() + self.timeout, 0, onack, onerror]
+				return False
+
+		self._transmit(self._nextseq(), req, 0, onack, onerror)
+
+		# Pick up any responses that are already in
+		return self._pump(False)
+
+	def _pipelineeach(self, packets, onack, onerror):
+		"""
+		Pipeline @packets one at a time for a server that doesn't take batches.
+		@onack is called once every one is acknowledged, or @onerror once they are all answered if any got an error.
+		"""
+
+		left = [len(packets), False]
+		def done(err):
+			left[0] -= 1
+			left[1] = left[1] or err
+			if left[0] == 0:
+				if left[1]:
+					if onerror is not None:
+						onerror()
+				elif onack is not None:
+					onack()
+
+		each = [None, None]
+		if onack is not None or onerror is not None:
+			each = [lambda: done(False), lambda: done(True)]
+
+		for i,packet in enumerate(packets):
+			if not isinstance(packet, dict):
+				# rtl_433 line from passthrough, which a server without batches doesn't take either
+				packet = json.loads(bytes(packet))
+			if not self.pipeline(packet, *each):
+				# Not sent, but track them so takeinflight() returns them
+				for packet in packets[i+1:]:
+					self._inflight[self._nextseq()] = [{'cmd': 'packet', 'packet': packet}, time.monotonic(), 0] + each
+				return False
+		return True
+
+	def _sendtcp(self, req, onack, onerror=None):
+		"""
+		Send packet request @req over TCP, which takes care of getting it there so there is no response to wait for.
+		Returns False if the connection was lost, then @req is returned by takeinflight().
+		"""
+
+		self._printreq(req)
+		seq = self._nextseq()
+		try:
+			self._send(self._encode(req, seq))
+		except OSError:
+			print("Connection to server lost")
+			self._disconnect()
+			self._inflight[seq] = [req, time.monotonic(), 0, onack, onerror]
+			return False
+
+		if self.delta and 'vers' in req:
+			# Only a resync gets a response, the server handles requests in order so any later response means it got this
+			self._unacked[seq] = req
+			if len(self._unacked) > DEFAULT_DELTA_UNACKED:
+				self._unacked.popitem(last=False)
+
+		# Delivered in order, so a later delta can be based on these right away
+		self._acked(req)
+		if onack is not None:
+			onack()
+		return True
+
+	def report(self, stats):
+		"""
+		Send client @stats (a dictionary, eg read queue metrics) to the server without waiting for the response.
+		Nothing is sent to a server that doesn't take reports.
+		Returns False if the server stopped responding.
+		"""
+
+		if not self.reports:
+			return self._pump(False)
+
+		return self._notify({'cmd': 'report', 'stats': stats})
+
+	def clocksync(self):
+		"""
+		Send a clock request so the response is a clock sample and the server gets the offset measured so far, without
+		waiting for the response. Packet requests do this already except over TCP or in passthrough mode.
+		Nothing is sent to a server that doesn't give clock samples.
+		Returns False if the server stopped responding.
+		"""
+
+		if not self.clock:
+			return self._pump(False)
+
+		return self._notify({'cmd': 'clock'})
+
+	def _notify(self, req):
+		"""
+		Send request @req without waiting for the response, which is only looked at for errors and clock samples.
+		Returns False if the server stopped responding.
+		"""
+
+		seq = self._nextseq()
+		if self._tcp:
+			try:
+				self._send(self._encode(req, seq))
+			except OSError:
+				print("Connection to server lost")
+				self._disconnect()
+				return False
+			return self._pump(False)
+
+		self._transmit(seq, req, 0, None)
+		return self._pump(False)
+
+	def poll(self):
+		"""
+		Handle any responses that have arrived and send again requests that timed out, without blocking.
+		Returns False if the server stopped responding.
+		"""
+
+		return self._pump(False)
+
+	def drain(self):
+		"""
+		Wait until every pipelined request has a response.
+		Returns False if the server stopped responding.
+		"""
+
+		while len(self._inflight):
+			if not self._pump(True):
+				return False
+		return True
+
+	def takeinflight(self):
+		"""
+		Return a list of (request, onack) for the pipelined requests still waiting on a response and forget about them.
+		"""
+
+		ret = [(_[0], _[3]) for _ in self._inflight.values()]
+		self._inflight.clear()
+		return ret
+
+	def _transmit(self, seq, req, tries, onack, onerror=None):
+		"""
+		Send pipelined request @req as @seq and track it until its response arrives.
+		"""
+
+		if tries == 0:
+			self._printreq(req)
+
+		self._inflight[seq] = [req, time.monotonic() + self.timeout, tries, onack, onerror]
+		try:
+			self._send(self._encode(req, seq))
+		except OSError:
+			# Network is unreachable or similar, it will be sent again when the deadline passes
+			self._disconnect()
+
+	def _encode(self, req, seq):
+		"""
+		Encode pipelined request @req numbered @seq.
+		A batch of rtl_433 lines goes as is in passthrough mode, or is parsed here if the server doesn't take them (eg, it changed).
+		In delta mode packets are encoded against the last acknowledged packet of the same sensor.
+		Requests carry the time they are sent and the measured clock offset, except rtl_433 lines as the raw1 header has no room.
+		"""
+
+		packets = req.get('packets')
+		if packets and not isinstance(packets[0], dict):
+			if self.raw:
+				return self._compress(rawcodec.encodelines(self._session_bytes, seq, packets))
+			req = dict(req, packets=[json.loads(bytes(_)) for _ in packets])
+
+		if 'vers' in req:
+			req = self._deltareq(req)
+
+		req = dict(req, session=self._session, seq=seq)
+		if self.clock or self.trace:
+			# Wall clock rather than monotonic like the server's own stamps, as the server moves it onto its clock with
+			# the offset measured between the two wall clocks; a monotonic clock means nothing on another host
+			req['sent'] = time.time()
+		if self.clock and self.offset is not None:
+			req['clock'] = [self.offset, self.rtt]
+		return self._compress(self._codec.encode(req))
+
+	def _clocksample(self, ret):
+		"""
+		Update the clock offset and round trip time from the [t0, t1, t2] clock sample in response @ret, if it has one:
+		t0 is when the request was sent, t1 when the server received it, and t2 when the server answered.
+		As in NTP, the sample with the shortest of the recent round trips is the one least skewed by queueing, and the
+		offset moves part of the way towards it so one odd sample doesn't jerk it around.
+		"""
+
+		sample = ret.get('clock')
+		if not isinstance(sample, list):
+			return
+
+		t3 = time.time()
+		t0,t1,t2 = sample
+		rtt = (t3 - t0) - (t2 - t1)
+		self._clock_samples.append( (rtt, ((t1 - t0) + (t2 - t3)) / 2) )
+		best = min(self._clock_samples)[1]
+
+		if self.offset is None:
+			self.offset = best
+			self.rtt = rtt
+		else:
+			self.offset += CLOCK_GAIN * (best - self.offset)
+			self.rtt += CLOCK_GAIN * (rtt - self.rtt)
+
+	def _deltareq(self, req):
+		"""
+		Return request @req with its packets delta encoded, or just without the versions if delta mode is off.
+		A packet is based on the one before it from the same sensor in the request, the server rebuilds them in order,
+		so a request with more than DEFAULT_DELTA_VERSIONS packets of a sensor doesn't outrun the packets the server keeps.
+		"""
+
+		vers = req['vers']
+		req = {k:v for k,v in req.items() if k != 'vers'}
+		if not self.delta:
+			return req
+
+		packets = req['packets'] if req['cmd'] == 'batch' else [req['packet']]
+		bases = {}
+		ret = []
+		for packet,ver in zip(packets, vers):
+			key = sensor_key(packet)
+			ret.append(self._deltapacket(packet, ver, bases.get(key, self._bases.get(key))))
+			bases[key] = (ver, packet)
+
+		if req['cmd'] == 'batch':
+			req['packets'] = ret
+		else:
+			req['packet'] = ret[0]
+		return req
+
+	def _deltapacket(self, packet, ver, base):
+		"""
+		Return @packet as version @ver, as the fields that changed from @base, (version, packet) of the same sensor, if there is one.
+		The server only keeps the last DEFAULT_DELTA_VERSIONS packets of a sensor, so if that many others were sent since
+		@base (eg, pipelined requests that aren't acknowledged yet) it may be gone and the full packet is sent instead.
+		"""
+
+		key = sensor_key(packet)
+		sent = self._sent.get(key)
+		if sent is None:
+			sent = self._sent[key] = collections.deque(maxlen=DEFAULT_DELTA_VERSIONS + 1)
+		# Versions only go up, a request sent again has ones that are already there or older
+		if not len(sent) or sent[-1] < ver:
+			sent.append(ver)
+
+		if base is not None and sum(1 for _ in sent if _ > base[0] and _ != ver) >= DEFAULT_DELTA_VERSIONS:
+			base = None
+
+		if base is None:
+			self._deltas[0] += 1
+			return dict(packet, _v=ver)
+
+		bver,bpacket = base
+		ret = {k:v for k,v in packet.items() if k not in bpacket or bpacket[k] != v or type(bpacket[k]) is not type(v)}
+		dels = [k for k in bpacket if k not in packet]
+		if len(dels):
+			ret['_d'] = dels
+		ret['_v'] = ver
+		ret['_b'] = bver
+		self._deltas[1] += 1
+		return ret
+
+	def _acked(self, req, n=None):
+		"""
+		The server acknowledged the first @n (all if None) packets of request @req, later deltas can be based on them.
+		"""
+
+		vers = req.get('vers')
+		if vers is None or not self.delta:
+			return
+
+		packets = req['packets'] if req['cmd'] == 'batch' else [req['packet']]
+		for packet,ver in zip(packets[:n], vers[:n]):
+			if not isinstance(packet, dict):
+				# rtl_433 lines from passthrough that were parsed to send, not kept
+				continue
+
+			key = sensor_key(packet)
+			base = self._bases.get(key)
+			# Responses can come out of order, keep the newest
+			if base is None or base[0] < ver:
+				self._bases[key] = (ver, packet)
+
+	def _compress(self, dat):
+		"""
+		Compress encoded request @dat if the server agreed on a dictionary and it comes out smaller.
+		"""
+
+		if self.zdict is None:
+			return dat
+
+		start = time.process_time()
+		z = zlibcodec.compress(dat, self.zdict)
+		self._compression[3] += time.process_time() - start
+		if len(z) >= len(dat):
+			return dat
+
+		self._compression[0] += 1
+		self._compression[1] += len(dat)
+		self._compression[2] += len(z)
+		return z
+
+	def stats(self):
+		"""
+		Return a dictionary of client statistics.
+		"""
+
+		ret = {}
+		if self.zdict is not None:
+			frames,frame,wire,cpu = self._compression
+			ret['compression'] = {
+				'zdict': self.zdict,
+				'frames': frames,
+				'bytes': wire,
+				'uncompressed': frame,
+				'ratio': frame / wire if wire else None,
+				'cpu': cpu,
+			}
+		if self.delta:
+			ret['delta'] = {
+				'full': self._deltas[0],
+				'deltas': self._deltas[1],
+				'resyncs': self._deltas[2],
+				'sensors': len(self._bases),
+			}
+		if self.offset is not None:
+			ret['clock'] = {'offset': self.offset, 'rtt': self.rtt}
+		return ret
+
+	def _printreq(self, req):
+		packets = req.get('packets')
+		if packets and not isinstance(packets[0], dict):
+			print("Sending to %s:%d: %d rtl_433 lines" % (self._host,self._port, len(packets)))
+		else:
+			print("Sending to %s:%d: %s" % (self._host,self._port, req))
+
+	def _pump(self, block):
+		"""
+		Send again timed out requests and handle responses.
+		If @block then wait up until the next retransmit deadline for a response.
+		Returns False if a request ran out of retries, or the TCP connection was lost.
+		"""
+
+		if self._tcp:
+			return self._pumptcp()
+
+		now = time.monotonic()
+		for seq,ent in list(self._inflight.items()):
+			if ent[1] > now:
+				continue
+
+			req,_,tries,onack,onerror = ent
+			tries += 1
+			if tries >= self.retries:
+				# Left in flight so takeinflight() returns it
+				print("No data received, server down?")
+				return False
+
+			print("\tRepeat %d of %d" % (tries, self.retries))
+			# Same seq so the server can tell it is a repeat
+			del self._inflight[seq]
+			self._transmit(seq, req, tries, onack, onerror)
+
+		if not len(self._inflight):
+			return True
+
+		if block:
+			timeout = max(min(_[1] for _ in self._inflight.values()) - now, 0.001)
+		else:
+			timeout = 0.0
+
+		while True:
+			try:
+				dat = self._recv(timeout)
+			except (socket.timeout, BlockingIOError):
+				break
+			except OSError:
+				# Likely a refused connection, let the deadline retransmit
+				self._disconnect()
+				break
+
+			# Every response has ret, without it it's a request looped back: a UDP socket can be given the server's port
+			# (and so be connected to itself) while nothing is bound to it, eg the server is starting
+			ret = self._decode(dat)
+			if ret is not None and 'ret' in ret:
+				self._response(ret)
+
+			# Read whatever else is already there without waiting
+			timeout = 0.0
+
+		return True
+
+	def _pumptcp(self):
+		"""
+		Handle whatever the TCP server sent, without blocking.
+		Returns False if the connection was lost.
+		"""
+
+		if self._sock is None:
+			return True
+
+		while True:
+			try:
+				dat = self._recv(0.0)
+			except (socket.timeout, BlockingIOError):
+				return True
+			except OSError:
+				print("Connection to server lost")
+				self._disconnect()
+				return False
+
+			ret = self._decode(dat)
+			if ret is not None and not self._push(ret):
+				return False
+
+	def _push(self, ret):
+		"""
+		Handle @ret sent by a TCP server without a request waiting on it: a notification, an error about a packet, or the
+		response to a report or clock request.
+		Returns False if the connection was lost sending packets again.
+		"""
+
+		self.server_version = ret.get('version', self.server_version)
+		self._clocksample(ret)
+
+		seq = ret.get('seq')
+		self._answered(seq)
+
+		if ret.get('ret') == 'resync':
+			# Server doesn't have the packet a delta is based on (eg, it forgot this session), send the rest again as full packets
+			print("Server lost delta state, resyncing")
+			self._deltas[2] += 1
+			self._bases.clear()
+
+			req = self._unacked.pop(seq, None)
+			if req is None:
+				print("Request to resync is no longer kept, packets lost")
+				return True
+
+			accepted = ret.get('accepted', 0)
+			if req['cmd'] == 'batch':
+				req = dict(req, packets=req['packets'][accepted:], vers=req['vers'][accepted:])
+			return self._sendtcp(req, None)
+
+		err = self._error(ret)
+		if err is not None:
+			print(err)
+		return True
+
+	def _answered(self, seq):
+		"""
+		A TCP server answered request @seq, requests are handled in order so it got every packet request sent before it.
+		"""
+
+		while len(self._unacked) and seq is not None and next(iter(self._unacked)) < seq:
+			self._unacked.popitem(last=False)
+
+	def _response(self, ret):
+		"""
+		Match response @ret to its pipelined request.
+		"""
+
+		self.server_version = ret.get('version', self.server_version)
+		self._clocksample(ret)
+
+		if 'seq' in ret:
+			seq = ret['seq']
+		else:
+			# Server without seq support answers in order
+			seq = next(iter(self._inflight), None)
+
+		ent = self._inflight.get(seq)
+		if ent is None:
+			# Response to a repeat that already got a response
+			return
+
+		if ret.get('ret') in ('busy', 'resync'):
+			req = ent[0]
+			accepted = ret.get('accepted', 0)
+			self._acked(req, accepted)
+			if req['cmd'] == 'batch':
+				del req['packets'][:accepted]
+				if 'vers' in req:
+					del req['vers'][:accepted]
+
+			if ret['ret'] == 'busy':
+				# Server dispatch queue is full, back off a little before it is repeated
+				# It answered, so tries start over and a busy server isn't taken for one that is down
+				print("Server busy")
+				ent[1] = time.monotonic() + BUSY_BACKOFF
+				ent[2] = 0
+			else:
+				# Server doesn't have the packet a delta is based on, send the rest again as full packets
+				print("Server lost delta state, resyncing")
+				self._deltas[2] += 1
+				self._bases.clear()
+				ent[1] = time.monotonic()
+			return
+
+		del self._inflight[seq]
+
+		err = self._error(ret)
+		if err is not None:
+			# Sending it again would get the same answer, but nothing was delivered so it isn't acknowledged
+			print(err)
+			if ent[4] is not None:
+				ent[4]()
+			return
+
+		self._acked(ent[0])
+		if ent[3] is not None:
+			ent[3]()
+
+	@staticmethod
+	def _error(ret):
+		"""
+		Return a description of the error or exception the server answered with in @ret, or None if it didn't.
+		"""
+
+		if 'error' in ret:
+			return "Response error: %s" % ret['error']
+		elif 'exception' in ret:
+			# (type name, args), a list once it has been through JSON
+			return "Server exception: %s(%s)" % tuple(ret['exception'])
+		return None
+
+	def getconfig(self):
+		"""
+		Poll the server for configuration information.
+		"""
+
+		# Keep looping until config is read
+		while True:
+			ret = self.probeconfig()
+			if ret is None:
+				print("No server found, retrying...")
+				time.sleep(1.0)
+				continue
+
+			return ret
+
+	def probeconfig(self):
+		"""
+		Ask the server for configuration information once.
+		Returns None if the server did not respond or answered with an error.
+		"""
+
+		req = {
+			'cmd': 'getconfig',
+		}
+		if self.codecs != [jsoncodec.name]:
+			req['codecs'] = self.codecs
+		if self._raw_wanted:
+			req['raw'] = True
+		if self._compress_wanted:
+			req['zdicts'] = list(zlibcodec.ZDICTS)
+		if self._delta_wanted:
+			req['delta'] = True
+		if self._trace_wanted:
+			req['trace'] = True
+		req['batch'] = True
+		req['report'] = True
+
+		# Always ask in JSON so any server understands, and negotiate the codec again as the server may have changed
+		self._codec = jsoncodec
+		# Measure the clock again too, the first sample is from this
+		self._clock_samples.clear()
+		self.offset = None
+		self.rtt = None
+		ret = self.write(req)
+		if ret is None:
+			return None
+		elif self._error(ret) is not None:
+			print(self._error(ret))
+			return None
+
+		self.config_version = ret.get('version')
+		self._codec = CODECS.get(ret.get('codec'), jsoncodec)
+		self.raw = self._raw_wanted and ret.get('raw') == rawcodec.name
+		self.zdict = ret.get('zdict') if ret.get('zdict') in zlibcodec.ZDICTS else None
+		# rtl_433 lines aren't parsed in passthrough mode, so there is nothing to delta encode
+		self.delta = self._delta_wanted and not self.raw and ret.get('delta') is True
+		self.batches = ret.get('batch') is True
+		self.reports = ret.get('report') is True
+		self.trace = self._trace_wanted and ret.get('trace') is True
+		self.clock = self.offset is not None
+		# Server may have restarted and lost what deltas are based on
+		self._bases.clear()
+		return ret['config']
+
+	def getstats(self):
+		"""
+		Ask the server for its statistics (see server.stats()).
+		Returns None if the server did not respond or the answer has none.
+		"""
+
+		ret = self.write({'cmd': 'stats'})
+		if ret is None:
+			return None
+		elif self._error(ret) is not None:
+			raise Exception(self._error(ret))
+
+		return ret.get('stats')
+
+	def config_changed(self):
+		"""
+		Returns True if a response from the server had a different configuration version than the last configuration fetched.
+		Always False for a server that doesn't report versions.
+		"""
+
+		return self.server_version is not None and self.server_version != self.config_version
+
+	def sendpacket(self, packet):
+		"""
+		Send a radio packet to the server.
+		"""
+
+		req = {
+			'cmd': 'packet',
+			'packet': packet,
+		}
+		ret = self.write(req)
+		if ret is None:
+			print("No data received, server down?")
+			return None
+		elif ret.get('ret') == 'busy':
+			# Server dispatch queue is full, back off a little before it is repeated
+			print("Server busy")
+			time.sleep(BUSY_BACKOFF)
+			return None
+		elif self._error(ret) is not None:
+			raise Exception(self._error(ret))
+
+		# Nothing back from the server, return empty dictionary (different from None)
+		# Use config_changed() to see if the configuration changed
+		return {}
+
+	def sendbatch(self, packets):
+		"""
+		Send a list of radio packets to the server in one request.
+		If the server is busy, the packets it accepted are removed from @packets so only the rest are sent again.
+		"""
+
+		req = {
+			'cmd': 'batch',
+			'packets': packets,
+		}
+		ret = self.write(req)
+		if ret is None:
+			print("No data received, server down?")
+			return None
+		elif ret.get('ret') == 'busy':
+			# Server dispatch queue is full, back off a little before the rest is repeated
+			print("Server busy")
+			del packets[:ret.get('accepted', 0)]
+			time.sleep(BUSY_BACKOFF)
+			return None
+		elif self._error(ret) is not None:
+			raise Exception(self._error(ret))
+
+		return {}
+
+	def queuepacket(self, packet):
+		"""
+		Add @packet to the pending batch, either a packet or an rtl_433 output line in passthrough mode.
+		Returns a list of batches that are full and ready to be sent, normally empty.
+		"""
+
+		ret = []
+
+		if isinstance(packet, dict):
+			# Approximate size on the wire, plus a comma and space between packets
+			sz = len(json.dumps(packet)) + 2
+		else:
+			# Line plus the newline between lines
+			sz = len(packet) + 1
+		if len(self._batch) and self._batch_len + sz > self.batch_bytes:
+			# Doesn't fit, send what is pending first
+			ret.append(self.takebatch())
+
+		if not len(self._batch):
+			self._batch_started = time.monotonic()
+		self._batch.append(packet)
+		self._batch_len += sz
+
+		if len(self._batch) >= self.batch_size or self._batch_len >= self.batch_bytes:
+			ret.append(self.takebatch())
+
+		return ret
+
+	def batchdue(self):
+		"""
+		Returns True if the oldest packet in the pending batch has waited batch_latency seconds or more.
+		"""
+
+		return len(self._batch) > 0 and time.monotonic() - self._batch_started >= self.batch_latency
+
+	def takebatch(self):
+		"""
+		Return the pending batch and start a new one.
+		"""
+
+		ret = self._batch
+		self._batch = []
+		self._batch_len = 0
+		self._batch_started = None
+		return ret
+
+	@staticmethod
+	def config_to_args(cfg, device=None):
+		"""
+		Convert a server.cfg INI style configuration file into python dictionary object tree.
+		If @device is given then the rtl_433 arguments are for that SDR (-d), with its frequency from [rtl433.devices] if set.
+		"""
+
+		opts = []
+
+		if device is not None:
+			opts.append('-d')
+			opts.append(device)
+
+		if device is not None and device in cfg.get('devices', {}):
+			opts.append('-f')
+			opts.append(cfg['devices'][device])
+		elif 'frequency' in cfg:
 			opts.append('-f')
 			opts.append(cfg['frequency'])
 		if 'metadata' in cfg:
@@ -1,13 +1,31 @@
 
+import collections
+import contextlib
+import itertools
 import json
 import os
+import queue
+import selectors
 import socket
 import subprocess
 import sys
+import threading
 import time
 
 import pyrtl433net
 
+# How often to check if the server is back while spooling
+SPOOL_PROBE_INTERVAL = 5.0
+
+# Initial size of the rtl_433 stdout read buffer, it grows for longer lines
+READ_BUFFER = 65536
+# How often the reader checks if rtl_433 quit without closing stdout
+READ_POLL_INTERVAL = 0.5
+# How often the client reports its read queue to the server
+REPORT_INTERVAL = 60.0
+# How often the client asks for a clock sample, which packet requests over TCP or in passthrough mode do not get
+CLOCK_INTERVAL = 16.0
+
 def main_server(args):
 	"""
 	Invoke the server
@@ -29,77 +47,528 @@ def main_client(args):
 	"""
 	Invoke the client and loop indefinitely
 	"""
-	with pyrtl433net.client(args.client[0]) as cli:
-		cnt = 1
+	if args.spool:
+		sp = pyrtl433net.spool(args.spool[0], args.spool_size[0])
+		print("Spooling to %s, %d packets already in it" % (args.spool[0], len(sp)))
+	else:
+		sp = pyrtl433net.memspool(args.buffer[0])
+
+	# Reader thread spools lines too if the read queue overflows
+	sp = lockedspool(sp)
+
+	# Lines read from rtl_433 wait here to be sent, kept over rtl_433 restarts
+	rq = linequeue(args.read_queue[0], args.overflow[0], sp)
+
+	try:
+		with pyrtl433net.client(args.client[0], batch_size=args.batch[0], batch_latency=args.batch_latency[0], batch_bytes=args.batch_bytes[0], window=args.window[0], codecs=args.codec, raw=args.raw, compress=args.compress, delta=args.delta, trace=args.trace) as cli:
+			if args.stats:
+				st = cli.getstats()
+				if st is None:
+					print("Server did not respond")
+					sys.exit(-1)
+				print(json.dumps(st, indent=2, sort_keys=True))
+				return
+
+			cnt = 1
+			cfg = None
+			while True:
+				print("Connecting...")
+				try:
+					if cfg is None:
+						cfg = cli.getconfig()
+
+					# Returns the new configuration if it changed, so restart rtl_433 right away with it
+					cfg = _main_client_innerloop(cli, args, sp, rq, cfg)
+					if cfg is not None:
+						continue
+				except socket.timeout:
+					print("Server not found %d" % cnt)
+					time.sleep(1.0)
+
+				# Iteration counter
+				cnt += 1
+				time.sleep(2.0)
+	finally:
+		sp.close()
+
+class lockedspool:
+	"""
+	Spool @sp that can be used from the reader thread and the sender at the same time.
+	"""
+
+	def __init__(self, sp):
+		self._sp = sp
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		with self._lock:
+			return len(self._sp)
+
+	def close(self):
+		with self._lock:
+			self._sp.close()
+
+	def append(self, dat):
+		with self._lock:
+			self._sp.append(dat)
+
+	def peek(self, maxbytes):
+		with self._lock:
+			return self._sp.peek(maxbytes)
+
+	def peekfirst(self, maxbytes):
+		"""
+		Return the position of the oldest record and peek(@maxbytes), together as the reader thread can drop records in between.
+		"""
+
+		with self._lock:
+			return self._sp.first, self._sp.peek(maxbytes)
+
+	def consume(self, n, first=None):
+		with self._lock:
+			self._sp.consume(n, first)
+
+class linequeue:
+	"""
+	Bounded queue of rtl_433 lines between the reader and the sender, so the reader never waits on the network.
+	Lines are put and taken in lists, when more than @size lines are waiting then @policy decides what happens:
+		drop-oldest drops the lines that waited longest
+		spool puts the new lines in spool @sp, to be sent after what is already spooled
+		conflate keeps only the latest line of each sensor, then drops the oldest if that isn't enough
+	"""
+
+	def __init__(self, size=pyrtl433net.DEFAULT_READ_QUEUE, policy=pyrtl433net.OVERFLOW_POLICIES[0], sp=None):
+		if policy not in pyrtl433net.OVERFLOW_POLICIES:
+			raise ValueError("Unknown overflow policy '%s', expected one of: %s" % (policy, ", ".join(pyrtl433net.OVERFLOW_POLICIES)))
+
+		self.size = size
+		self.policy = policy
+		self._sp = sp
+
+		self._q = collections.deque()
+		self._len = 0
+		self._eof = False
+		self._cond = threading.Condition()
+
+		self.max_depth = 0
+		self.dropped = 0
+		self.spooled = 0
+		self.conflated = 0
+
+	def put(self, lines):
+		"""
+		Add the list @lines, or None once there are no more.
+		"""
+
+		with self._cond:
+			if lines is None:
+				self._eof = True
+			else:
+				if self._len + len(lines) > self.size:
+					lines = self._overflow(lines)
+				if len(lines):
+					self._q.append(lines)
+					self._len += len(lines)
+					self.max_depth = max(self.max_depth, self._len)
+			self._cond.notify()
+
+	def _overflow(self, lines):
+		"""
+		Make room for @lines according to the policy, returns the lines to add.
+		"""
+
+		if self.policy == 'spool':
+			for line in lines:
+				if len(line) and line[0] == 0x7B:
+					self._sp.append(line)
+			self.spooled += len(lines)
+			return []
+
+		if self.policy == 'conflate':
+			# Latest line of each sensor, in the order they were last seen
+			latest = {}
+			for line in itertools.chain(itertools.chain.from_iterable(self._q), lines):
+				if len(line) and line[0] == 0x7B:
+					key = pyrtl433net.sensor_key(pyrtl433net.lazypacket(line))
+					latest.pop(key, None)
+					latest[key] = line
+			n = self._len + len(lines)
+			self._q.clear()
+			self._len = 0
+			self.conflated += n - len(latest)
+			lines = list(latest.values())
+
+		# Drop the oldest to fit
+		while len(self._q) and self._len + len(lines) > self.size:
+			self._len -= len(self._q[0])
+			self.dropped += len(self._q.popleft())
+		if len(lines) > self.size:
+			self.dropped += len(lines) - self.size
+			lines = lines[-self.size:]
+		return lines
+
+	def get(self, timeout):
+		"""
+		Take the oldest list of lines, or None if there are no more.
+		Raises queue.Empty if nothing shows up within @timeout seconds.
+		"""
+
+		with self._cond:
+			if not len(self._q) and not self._eof:
+				self._cond.wait(timeout)
+			if len(self._q):
+				lines = self._q.popleft()
+				self._len -= len(lines)
+				return lines
+			if self._eof:
+				return None
+			raise queue.Empty()
+
+	def putback(self, lines):
+		"""
+		Put the list @lines back in front, they were taken but not used.
+		"""
+
+		if not len(lines):
+			return
+
+		with self._cond:
+			self._q.appendleft(lines)
+			self._len += len(lines)
+
+	def reopen(self):
+		"""
+		Take more lines after None was put, eg from rtl_433 being restarted. Lines still waiting are kept.
+		"""
+
+		with self._cond:
+			self._eof = False
+
+	def lines(self, timeout):
+		"""
+		Generator of lines (as bytes without the newline).
+		None is generated if no complete line shows up within @timeout seconds, so the caller can check on pending batches.
+		Returns once None is put (ie, rtl_433 quit).
+		"""
+
 		while True:
-			print("Connecting...")
 			try:
-				_main_client_innerloop(cli, args)
-			except socket.timeout:
-				print("Server not found %d" % cnt)
-				time.sleep(1.0)
+				lines = self.get(timeout)
+			except queue.Empty:
+				yield None
+				continue
+
+			if lines is None:
+				return
+
+			for i,line in enumerate(lines):
+				try:
+					yield line
+				except GeneratorExit:
+					# Caller stopped (eg, to restart rtl_433), keep the rest for next time
+					self.putback(lines[i+1:])
+					raise
+
+	def stats(self):
+		"""
+		Return a dictionary of the queue depth and what overflowed.
+		"""
+
+		with self._cond:
+			return {
+				'policy': self.policy,
+				'size': self.size,
+				'depth': self._len,
+				'max_depth': self.max_depth,
+				'dropped': self.dropped,
+				'spooled': self.spooled,
+				'conflated': self.conflated,
+			}
+
+def _spool_packets(sp, dat):
+	"""
+	Append @dat, a single packet or a list of packets, to spool @sp.
+	Packets are rtl_433 output lines (bytes) in passthrough mode, which are already what is stored.
+	"""
 
-			# Iteration counter
-			cnt += 1
-			time.sleep(2.0)
+	if not isinstance(dat, list):
+		dat = [dat]
+	for packet in dat:
+		if isinstance(packet, dict):
+			sp.append(json.dumps(packet).encode('utf-8'))
+		else:
+			sp.append(bytes(packet))
 
-def _main_client_innerloop(cli, args):
+def _main_client_innerloop(cli, args, sp, rq, cfg):
 	"""
-	Inner loop that invokes rtl_433 as a process, read the stdout from it, and send each radio packet to the server.
+	Inner loop that invokes rtl_433 as a process with configuration @cfg, read the stdout from it, and send each radio packet to the server.
+	A reader thread puts the lines on linequeue @rq and this loop sends them, so rtl_433 output is read even while this waits on the server.
+	While the server is unreachable, rtl_433 is kept running and packets are held in @sp until the server is back.
+	Returns the new configuration if the server came back with a different one, or None if rtl_433 quit.
 	"""
 
-	cfg = cli.getconfig()
-	opts = cli.config_to_args(cfg)
+	cfg_hash = pyrtl433net.config_hash(cfg)
+
+	# One rtl_433 for each SDR, or just the one without picking a device
+	devices = args.device or [None]
+	cmds = []
+	for device in devices:
+		opts = cli.config_to_args(cfg, device)
+
+		# Binary goes first
+		opts.insert(0, args.rtl433[0])
 
-	# Binary goes first
-	opts.insert(0, args.rtl433[0])
+		# Lastly, spit out the radio packets as a JSON object
+		opts.append('-F')
+		opts.append('json')
 
-	# Lastly, spit out the radio packets as a JSON object
-	opts.append('-F')
-	opts.append('json')
+		print(" ".join(opts))
+		cmds.append(opts)
 
-	print(" ".join(opts))
 	if args.dryrun:
 		sys.exit(0)
 
+	# Wake up often enough to send a batch that has waited long enough and to repeat requests that timed out
+	timeout = min(cli.batch_latency, cli.timeout / 4)
+
+	# The server being down doesn't stop rtl_433, packets go to the spool until it is back
+	offline = False
+	next_probe = 0.0
+
+	# Spool is drained one batch at a time at the drain rate, draining is the number of records in flight
+	draining = 0
+	next_drain = 0.0
+	drain_rate = args.drain_rate[0]
+
+	# Records appended while the spool is full push out the oldest, so only those still where the batch was taken go
+	def drained(n, first):
+		nonlocal draining
+		sp.consume(n, first)
+		draining = 0
+
+	# Server refused the batch, so the records stay and draining waits a while before trying them again
+	def drain_refused():
+		nonlocal draining, next_drain
+		draining = 0
+		next_drain = time.monotonic() + SPOOL_PROBE_INTERVAL
+
+	# Read queue metrics go to the server now and then
+	next_report = time.monotonic() + REPORT_INTERVAL
+	next_clock = time.monotonic() + CLOCK_INTERVAL
+
 	# TODO: look at stderr and use return code to interpret why rtl_433 quit
-	with subprocess.Popen(opts, stdout=subprocess.PIPE) as p:
+	with contextlib.ExitStack() as stack:
+		procs = [stack.enter_context(subprocess.Popen(opts, stdout=subprocess.PIPE)) for opts in cmds]
+		rq.reopen()
+		# Packets are tagged with their radio if there are devices
+		readers = [linereader(p, rq, device, cli.trace or cli.clock) for p,device in zip(procs, devices)]
 		try:
-			while True:
-				if p.poll() is not None:
-					# Process quit, so return
-					return
+			# All of them are restarted if one quits
+			for line in rq.lines(timeout):
+				batches = []
+				if line is None:
+					pass
+
+				elif cli.raw:
+					# Passthrough, the line goes on as is and the server parses it
+					if len(line) and line[0] == ord('{'):
+						batches = cli.queuepacket(line)
+
+				else:
+					line = str(line, 'utf-8')
+					line = line.strip()
+					if len(line):
+						j = json.loads(line)
 
-				line = p.stdout.readline()
-				line = line.decode('utf-8')
-				line = line.strip()
-				if len(line):
-					j = json.loads(line)
+						if cli.batch_size > 1:
+							batches = cli.queuepacket(j)
+						else:
+							batches = [j]
 
-					ret = send_repeat(cli, j)
+				if cli.batchdue():
+					batches.append(cli.takebatch())
+
+				now = time.monotonic()
+				if offline:
+					for dat in batches:
+						_spool_packets(sp, dat)
+					if now < next_probe:
+						continue
+
+					ret = cli.probeconfig()
 					if ret is None:
-						print("Failed to received, quit reading data until new config received...")
-						# Server stopped responding, fall out and reconnect to get fresh config
-						return
-		finally:
-			# Can't return without killing the process first
-			p.kill()
+						next_probe = now + SPOOL_PROBE_INTERVAL
+						continue
+					if pyrtl433net.config_hash(ret) != cfg_hash:
+						print("Server is back with a different configuration, restarting rtl_433 (%d packets spooled)" % len(sp))
+						return ret
+
+					print("Server is back, draining %d spooled packets" % len(sp))
+					offline = False
+					continue
+
+				ok = cli.poll()
+
+				# Server pushed a new configuration version in a response
+				if ok and cli.config_changed():
+					ret = cli.probeconfig()
+					if ret is None:
+						# Server went away, probe again every SPOOL_PROBE_INTERVAL like any other outage
+						ok = False
+					elif pyrtl433net.config_hash(ret) != cfg_hash:
+						print("Configuration changed, restarting rtl_433")
+						# Hold on to what is pending so it isn't lost over the restart
+						for dat in batches:
+							_spool_packets(sp, dat)
+						return ret
+
+				for dat in batches:
+					if not ok:
+						# Rest go to the spool
+						_spool_packets(sp, dat)
+						continue
+					ok = cli.pipeline(dat)
+
+				# Send the next batch of spooled packets, one batch in flight at a time
+				if ok and len(sp) and not draining and now >= next_drain:
+					first,recs = sp.peekfirst(cli.batch_bytes)
+					draining = len(recs)
+					next_drain = now + draining / drain_rate
+					if not cli.raw:
+						recs = [json.loads(_) for _ in recs]
+					ok = cli.pipeline(recs, onack=lambda n=draining, first=first: drained(n, first), onerror=drain_refused)
+
+				if ok and now >= next_report:
+					next_report = now + REPORT_INTERVAL
+					ok = cli.report({'read_queue': rq.stats(), 'client': cli.stats()})
+
+				if ok and now >= next_clock:
+					next_clock = now + CLOCK_INTERVAL
+					ok = cli.clocksync()
+
+				if not ok:
+					lost = cli.takeinflight()
 
-	return
+					# Requests that didn't get a response go to the spool, except spooled packets being drained as they are still in it
+					for req,onack in lost:
+						if onack is None and req['cmd'] in ('packet', 'batch'):
+							_spool_packets(sp, req['packets'] if req['cmd'] == 'batch' else req['packet'])
+					draining = 0
 
-def send_repeat(cli, dat, repeat=5):
-	cnt = 0
-	while cnt < repeat:
-		ret = cli.sendpacket(dat)
-		if ret is not None:
-			return ret
+					print("Server stopped responding, spooling packets (%d spooled)" % len(sp))
+					offline = True
+					next_probe = now + SPOOL_PROBE_INTERVAL
 
-		print("\tRepeat %d of %d" % (cnt, repeat))
-		cnt += 1
+			# Process quit, so return
+			return None
+		finally:
+			# Can't return without killing the processes first
+			for p in procs:
+				p.kill()
+			for reader in readers:
+				reader.close()
 
-	# Tried @repeat times
 	return None
 
+class linereader:
+	"""
+	Reads lines from the stdout of rtl_433 process @p in a thread and puts them on linequeue @q, so parsing and sending
+	overlap with reading and rtl_433 isn't held up by either.
+	Whatever is available is read with one non-blocking read into a reusable buffer, lines are found in it through a
+	memoryview and only copied once, as they go on the queue in one list per read.
+	If @radio is given then a radio field with it is added to each packet as part of that copy.
+	If @stamp is True then a _tr field with the time it was read is added too, for the server to timestamp and trace it.
+	"""
+
+	def __init__(self, p, q, radio=None, stamp=False):
+		self._p = p
+		self._fd = p.stdout.fileno()
+		os.set_blocking(self._fd, False)
+
+		self._sel = selectors.DefaultSelector()
+		self._sel.register(self._fd, selectors.EVENT_READ)
+
+		self._buf = bytearray(READ_BUFFER)
+		# Bytes of a partial line at the start of the buffer
+		self._len = 0
+
+		self.queue = q
+
+		# Spliced in after the opening brace of each line
+		self._prefix = None
+		if radio is not None:
+			self._prefix = ('{"radio" : %s, ' % json.dumps(str(radio))).encode('utf-8')
+		self._stamp = stamp
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def close(self):
+		"""
+		Wait for the reader to finish, the process has to be killed first.
+		"""
+
+		self._thread.join()
+		self._sel.close()
+
+	def _run(self):
+		try:
+			while self._read():
+				pass
+		finally:
+			self.queue.put(None)
+
+	def _read(self):
+		"""
+		Wait for and read what is available, put the complete lines on the queue.
+		Returns False once stdout is closed or the process quit.
+		"""
+
+		if not len(self._sel.select(READ_POLL_INTERVAL)):
+			# Nothing to read, but notice if rtl_433 is gone and something else holds stdout open
+			return self._p.poll() is None
+
+		if self._len == len(self._buf):
+			# Line longer than the buffer
+			self._buf.extend(bytes(len(self._buf)))
+
+		mv = memoryview(self._buf)
+		try:
+			n = os.readv(self._fd, [mv[self._len:]])
+		except BlockingIOError:
+			return True
+		if not n:
+			# EOF
+			return False
+
+		end = self._len + n
+		prefix = self._prefix
+		if self._stamp:
+			# Read stamp goes first, where the server looks for it
+			# Wall clock, not monotonic, so the server can move it onto its clock with the offset the client measured
+			prefix = pyrtl433net.TRACE_PREFIX + b'%.6f, ' % time.time() + (prefix[1:] if prefix is not None else b'')
+
+		lines = []
+		start = 0
+		while True:
+			nl = self._buf.find(b'\n', start, end)
+			if nl < 0:
+				break
+			if prefix is not None and nl - start > 2 and self._buf[start] == 0x7B:
+				lines.append(prefix + mv[start+1:nl])
+			else:
+				lines.append(bytes(mv[start:nl]))
+			start = nl + 1
+		mv.release()
+
+		# Partial line goes to the start for the next read
+		self._len = end - start
+		if start and self._len:
+			self._buf[:self._len] = self._buf[start:end]
+
+		if len(lines):
+			self.queue.put(lines)
+		return True
+
 def main(args=None):
 	args = pyrtl433net.parse_args(args)
 
@@ -0,0 +1,365 @@
+"""
+pyrtl433net.bench -- throughput and latency benchmark without SDR hardware
+
+A stand-in for rtl_433 writes -F json lines at a steady rate, either made up or replayed from a file of real rtl_433 output.
+It is installed as pyrtl433net-fakertl433 so it can be given to a client with --rtl433, and takes its settings from the
+environment as the client only passes it rtl_433 arguments:
+	PYRTL433NET_FAKE_RATE is packets per second, default 10
+	PYRTL433NET_FAKE_COUNT is how many packets to write before going quiet, 0 (default) for no end
+	PYRTL433NET_FAKE_FILE is a file of rtl_433 -F json output to replay over and over instead of made up packets
+	PYRTL433NET_FAKE_SENSORS is how many made up sensors take turns, default 20
+
+The benchmark starts a server on localhost with the no-op handler in this module and a number of clients running the
+stand-in, waits for the packets to arrive, and reports packets per second, latency from the client reading a packet to the
+handler finishing (from --trace), packets lost, and the CPU time of each process:
+	python3 -m pyrtl433net.bench --clients 4 --rate 500 --count 10000 -- --batch 50 --codec bin1
+
+Anything after -- is passed on to each client.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pyrtl433net
+
+DEFAULT_FAKE_RATE = 10.0
+DEFAULT_FAKE_SENSORS = 20
+
+DEFAULT_CLIENTS = 1
+DEFAULT_RATE = 100.0
+DEFAULT_COUNT = 1000
+# How long to keep waiting after the last packet showed up at the server
+DEFAULT_SETTLE = 3.0
+# How often the server's statistics are polled while waiting, more often until the first packet shows up as that is the start
+POLL_INTERVAL = 0.5
+START_POLL_INTERVAL = 0.01
+
+# Made up sensors, each is a model and what it reports
+FAKE_MODELS = (
+	('Fineoffset-WH51', lambda r: {'battery_ok': 1.0, 'battery_mV': 1600, 'moisture': r.randint(10, 60), 'boost': 0, 'ad_raw': r.randint(100, 400), 'mic': 'CRC'}),
+	('Acurite-Tower', lambda r: {'channel': 'A', 'battery_ok': 1, 'temperature_C': round(r.uniform(-10, 35), 1), 'humidity': r.randint(20, 90), 'mic': 'CHECKSUM'}),
+	('LaCrosse-TX141THBv2', lambda r: {'channel': 0, 'battery_ok': 1, 'temperature_C': round(r.uniform(-10, 35), 2), 'humidity': r.randint(20, 90), 'test': 'No'}),
+	('Ambientweather-F007TH', lambda r: {'channel': 1, 'battery_ok': 1, 'temperature_F': round(r.uniform(10, 95), 1), 'humidity': r.randint(20, 90), 'mic': 'CRC'}),
+)
+
+def rtl433_handler(server, client, packet):
+	"""
+	No-op handler, so the benchmark measures pyrtl433net and not what is done with the packets.
+	"""
+
+	pass
+
+def fake_sensors(sensors=DEFAULT_FAKE_SENSORS, seed=None):
+	"""
+	Generator of made up rtl_433 packets (dicts) from @sensors sensors taking turns.
+	Level metadata (rssi, snr, noise) is included as with -M level.
+	"""
+
+	r = random.Random(seed)
+	ids = [(FAKE_MODELS[i % len(FAKE_MODELS)], r.randint(1, 0xFFFFFF)) for i in range(sensors)]
+	while True:
+		for (model,fields),sid in ids:
+			packet = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'model': model, 'id': sid}
+			packet.update(fields(r))
+			packet['mod'] = 'ASK'
+			packet['freq'] = round(r.uniform(914.9, 915.1), 3)
+			packet['rssi'] = round(r.uniform(-12, -0.1), 3)
+			packet['snr'] = round(r.uniform(5, 25), 3)
+			packet['noise'] = round(r.uniform(-30, -20), 3)
+			yield packet
+
+def fake_packets(sensors=DEFAULT_FAKE_SENSORS, seed=None):
+	"""
+	Generator of made up rtl_433 -F json lines (bytes without the newline) from @sensors sensors taking turns.
+	"""
+
+	for packet in fake_sensors(sensors, seed):
+		yield json.dumps(packet).encode('utf-8')
+
+def replay_packets(fname):
+	"""
+	Generator of the rtl_433 -F json lines (bytes without the newline) in @fname, over and over.
+	"""
+
+	with open(fname, 'rb') as f:
+		lines = [_.strip() for _ in f if _.startswith(b'{')]
+	if not len(lines):
+		raise ValueError("No rtl_433 JSON lines in '%s'" % fname)
+
+	while True:
+		yield from lines
+
+def fake_rtl433(out, rate, count, packets):
+	"""
+	Write lines from generator @packets to binary stream @out at @rate per second until @count are written (0 for no end).
+	Lines that are due are written together, so high rates don't cost a write per line.
+	"""
+
+	start = time.monotonic()
+	n = 0
+	while not count or n < count:
+		due = int((time.monotonic() - start) * rate) + 1
+		if count:
+			due = min(due, count)
+		if due > n:
+			out.write(b''.join(next(packets) + b'\n' for _ in range(due - n)))
+			out.flush()
+			n = due
+		time.sleep(max(start + n / rate - time.monotonic(), 0.0))
+
+def fake_main(args=None):
+	"""
+	Entry point of the rtl_433 stand-in: the arguments are what the client gives rtl_433 and are ignored, the settings come from
+	the environment.
+	"""
+
+	rate = float(os.environ.get('PYRTL433NET_FAKE_RATE', DEFAULT_FAKE_RATE))
+	count = int(os.environ.get('PYRTL433NET_FAKE_COUNT', 0))
+	fname = os.environ.get('PYRTL433NET_FAKE_FILE')
+	if fname:
+		packets = replay_packets(fname)
+	else:
+		packets = fake_packets(int(os.environ.get('PYRTL433NET_FAKE_SENSORS', DEFAULT_FAKE_SENSORS)))
+
+	try:
+		fake_rtl433(sys.stdout.buffer, rate, count, packets)
+
+		# Like rtl_433 with nothing on the air, stay up until killed so the client doesn't restart it
+		while True:
+			time.sleep(3600)
+	except (BrokenPipeError, KeyboardInterrupt):
+		# Client went away
+		pass
+
+def parse_args(args=None):
+	"""
+	Given a list of args @args, parse them and return the parser object.
+	If @args is None, then it will pull from the sys.argv.
+	Arguments after -- are kept as client_args for the clients.
+	"""
+
+	if args is None:
+		args = sys.argv[1:]
+	client_args = []
+	if '--' in args:
+		i = args.index('--')
+		args,client_args = args[:i],args[i+1:]
+
+	p = argparse.ArgumentParser(
+		prog="pyrtl433net.bench",
+		description="Benchmark a pyrtl433net server and clients on localhost with a stand-in for rtl_433, arguments after -- are passed to each client"
+	)
+	p.add_argument('--clients', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_CLIENTS], help="Number of clients, default is %d" % DEFAULT_CLIENTS)
+	p.add_argument('--rate', action="store", nargs=1, type=float, metavar="N", default=[DEFAULT_RATE], help="Packets per second from each client, default is %d" % DEFAULT_RATE)
+	p.add_argument('--count', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_COUNT], help="Packets from each client, default is %d" % DEFAULT_COUNT)
+	p.add_argument('--file', action="store", nargs=1, metavar="FILE", help="Replay this file of rtl_433 -F json output instead of made up packets")
+	p.add_argument('--sensors', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_FAKE_SENSORS], help="Made up sensors per client, default is %d" % DEFAULT_FAKE_SENSORS)
+	p.add_argument('--tcp', action="store_true", default=False, help="Clients use the TCP transport")
+	p.add_argument('--server-option', action="append", metavar="KEY=VALUE", default=[], help="Option for the [server] section of the server configuration (eg, workers=4), can be repeated")
+	p.add_argument('--settle', action="store", nargs=1, type=float, metavar="SEC", default=[DEFAULT_SETTLE], help="Seconds to wait for more packets after the last one arrived, default is %.1f" % DEFAULT_SETTLE)
+	p.add_argument('--verbose', action="store_true", default=False, help="Show the output of the server and clients")
+
+	ret = p.parse_args(args)
+	ret.client_args = client_args
+	return ret
+
+def _free_port():
+	with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+def _fake_bin(tmpdir):
+	"""
+	Return the path of the rtl_433 stand-in, the installed script or one written to @tmpdir that runs fake_main() with
+	this python so it works without installing.
+	"""
+
+	path = shutil.which('pyrtl433net-fakertl433')
+	if path is not None:
+		return path
+
+	path = os.path.join(tmpdir, 'fakertl433')
+	with open(path, 'w') as f:
+		f.write("#!%s\nimport sys\nsys.path.insert(0, %r)\nimport pyrtl433net.bench\npyrtl433net.bench.fake_main()\n" % (sys.executable, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+	os.chmod(path, 0o755)
+	return path
+
+def _getstats(mon):
+	"""
+	Return the server statistics from client @mon, None if it did not respond, without the client printing the request.
+	"""
+
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		return mon.getstats()
+
+def _stop(p):
+	"""
+	Interrupt process @p so it cleans up (a client kills its rtl_433), and return its CPU seconds (user, system).
+	That includes processes it started and waited for, so for a client it includes the rtl_433 stand-in.
+	"""
+
+	if p.returncode is not None:
+		# Already reaped, what it used is gone
+		return 0.0, 0.0
+
+	# Not Popen.send_signal() or poll() as they reap it without keeping what it used
+	os.kill(p.pid, signal.SIGINT)
+	deadline = time.monotonic() + 5.0
+	while True:
+		pid,status,ru = os.wait4(p.pid, os.WNOHANG)
+		if pid:
+			break
+		if time.monotonic() > deadline:
+			p.kill()
+			pid,status,ru = os.wait4(p.pid, 0)
+			break
+		time.sleep(0.05)
+
+	# Reaped here, so keep Popen from trying again
+	p.returncode = status
+	return ru.ru_utime, ru.ru_stime
+
+def run(args):
+	"""
+	Run the benchmark described by parsed @args (see parse_args()) and return a dictionary of the results.
+	"""
+
+	n = args.clients[0]
+	rate = args.rate[0]
+	count = args.count[0]
+	port = _free_port()
+	out = None if args.verbose else subprocess.DEVNULL
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		cfg = os.path.join(tmpdir, 'server.cfg')
+		with open(cfg, 'w') as f:
+			f.write("[server]\ninterface = 127.0.0.1\nport = %d\n" % port)
+			if args.tcp:
+				f.write("transport = udp tcp\n")
+			for opt in args.server_option:
+				k,v = opt.split('=', 1)
+				f.write("%s = %s\n" % (k.strip(), v.strip()))
+			f.write("\n[rtl433]\nfrequency = 915M\nmetadata = level\nfsk = minimax\n\n[rtl433.decoders]\n")
+
+		env = dict(os.environ)
+		env['PYRTL433NET_FAKE_RATE'] = str(rate)
+		env['PYRTL433NET_FAKE_COUNT'] = str(count)
+		env['PYRTL433NET_FAKE_SENSORS'] = str(args.sensors[0])
+		if args.file:
+			env['PYRTL433NET_FAKE_FILE'] = os.path.abspath(args.file[0])
+		# Run this copy of pyrtl433net even if it isn't installed
+		env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [_ for _ in [env.get('PYTHONPATH')] if _])
+
+		launched = time.monotonic()
+		srv = subprocess.Popen([sys.executable, '-m', 'pyrtl433net', '--server', cfg, '--handler', 'pyrtl433net.bench'], stdout=out, stderr=out, env=env)
+		clients = []
+		try:
+			with pyrtl433net.client('127.0.0.1:%d' % port, timeout=0.5) as mon:
+				# Wait for the server to answer
+				deadline = time.monotonic() + 10.0
+				st = None
+				while st is None:
+					st = _getstats(mon)
+					if st is None:
+						if time.monotonic() > deadline:
+							raise Exception("Benchmark server did not start, see why with --verbose")
+						# Refused right away until the server is listening
+						time.sleep(START_POLL_INTERVAL)
+
+				fake = _fake_bin(tmpdir)
+				hostport = ('tcp://127.0.0.1:%d' if args.tcp else '127.0.0.1:%d') % port
+				clients_launched = time.monotonic()
+				for i in range(n):
+					cmd = [sys.executable, '-m', 'pyrtl433net', '--client', hostport, '--rtl433', fake, '--trace'] + args.client_args
+					clients.append(subprocess.Popen(cmd, stdout=out, stderr=out, env=env))
+
+				# Wait until everything arrived, or nothing more arrived for a while after the clients should be done
+				# The rate is measured from the first packets the server has, so starting the clients and rtl_433 doesn't count
+				expected = n * count
+				received = 0
+				start = None
+				first = 0
+				last = time.monotonic()
+				end = last + count / rate
+				answered = True
+				while True:
+					time.sleep(POLL_INTERVAL if start is not None else START_POLL_INTERVAL)
+					ret = _getstats(mon)
+					answered = ret is not None
+					if answered:
+						st = ret
+						got = sum(_['packets'] for _ in st['metrics']['clients'].values())
+						if got > received:
+							last = time.monotonic()
+							if start is None:
+								start = last
+								first = got
+								end = start + count / rate
+							received = got
+						if received >= expected:
+							break
+
+					# Also when the server doesn't answer, so one that died or hung doesn't keep this waiting forever
+					if time.monotonic() > max(end, last) + args.settle[0]:
+						break
+
+			if not answered:
+				print("Benchmark server stopped answering, see why with --verbose")
+			elapsed = 0.0 if start is None else last - start
+		finally:
+			# CPU seconds and how long each ran, as the CPU time includes starting up
+			cpu = {}
+			for i,p in enumerate(clients):
+				cpu['client%d' % i] = _stop(p) + (time.monotonic() - clients_launched,)
+			cpu['server'] = _stop(srv) + (time.monotonic() - launched,)
+
+	# Stages without samples weren't measured (eg, the handler with aggregate de-duplication), not zero
+	trace = {k:v for k,v in st.get('trace', {}).get('stages', {}).items() if v['count']}
+	total = trace.get('total', {})
+	return {
+		'clients': n,
+		'expected': expected,
+		'received': received,
+		'lost': expected - received,
+		'elapsed': elapsed,
+		'rate': (received - first) / elapsed if elapsed > 0 else 0.0,
+		'latency_p50': total.get('p50'),
+		'latency_p99': total.get('p99'),
+		'stages': {k: (v['p50'], v['p99']) for k,v in trace.items()},
+		'cpu': {k: {'user': u, 'system': s, 'percent': 100 * (u + s) / wall} for k,(u,s,wall) in cpu.items()},
+		'errors': st['metrics']['errors'],
+	}
+
+def report(res):
+	"""
+	Print benchmark results @res from run().
+	"""
+
+	print("Clients:   %d" % res['clients'])
+	print("Packets:   %d of %d received, %d lost (%.2f%%)" % (res['received'], res['expected'], res['lost'], 100 * res['lost'] / res['expected'] if res['expected'] else 0.0))
+	print("Rate:      %.1f packets/s over %.2f s" % (res['rate'], res['elapsed']))
+	if res['latency_p50'] is not None:
+		print("Latency:   p50 %.3f ms, p99 %.3f ms (read by the client until the handler is done)" % (res['latency_p50'] * 1000, res['latency_p99'] * 1000))
+	for stage,(p50,p99) in res['stages'].items():
+		print("  %-8s p50 %.3f ms, p99 %.3f ms" % (stage, p50 * 1000, p99 * 1000))
+	print("CPU:")
+	for name,c in res['cpu'].items():
+		print("  %-8s user %.2f s, system %.2f s, %.1f%% of a core" % (name, c['user'], c['system'], c['percent']))
+	if len(res['errors']):
+		print("Errors:    %s" % ", ".join("%s %d" % kv for kv in sorted(res['errors'].items())))
+
+def main(args=None):
+	report(run(parse_args(args)))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,419 @@
+"""
+pyrtl433net.loadgen -- find how much a server can take
+
+Many virtual clients are run from one process with asyncio, each with its own UDP socket and session, speaking the same
+getconfig and packet/batch protocol as the client. Made up packets come from a mix of sensors, each heard by one client,
+and some transmissions are also heard by other clients (overlap) so de-duplication has work to do.
+Bursts raise the rate for a few seconds now and then.
+
+The rate is ramped up in steps until more packets than allowed are refused (busy) or go unanswered, and the highest rate the
+server kept up with and the rate drops started at are reported:
+	python3 -m pyrtl433net --server server.cfg --handler pyrtl433net.bench
+	python3 -m pyrtl433net.loadgen --client 127.0.0.1 --sessions 50 --overlap 0.3 --batch 10
+
+Python has to keep up too, so the CPU used here is reported for each step; near 100% the generator is the limit, not the server.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import time
+
+import pyrtl433net
+import pyrtl433net.bench
+
+DEFAULT_SESSIONS = 10
+DEFAULT_SENSORS = 200
+DEFAULT_START_RATE = 100.0
+DEFAULT_RAMP = 1.5
+DEFAULT_STEP = 5.0
+DEFAULT_LOSS = 0.01
+DEFAULT_OVERLAP = 0.0
+DEFAULT_COPIES = 2
+DEFAULT_TIMEOUT = 1.0
+
+# How often packets that are due are sent
+TICK = 0.01
+
+class session(asyncio.DatagramProtocol):
+	"""
+	One virtual client of @load: a UDP socket with its own session that sends requests and matches up the responses.
+	Packets for it are put in pending and sent by flush().
+	"""
+
+	def __init__(self, load):
+		self._load = load
+		self.session = os.urandom(8).hex()
+		self._seq = 0
+		self._codec = pyrtl433net.jsoncodec
+		self.transport = None
+
+		# seq -> [time sent, packets in it, future waiting on the response or None]
+		self._inflight = {}
+
+		self.pending = []
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def error_received(self, exc):
+		# Eg, nothing listening, the requests time out
+		pass
+
+	def datagram_received(self, data, addr):
+		try:
+			ret = pyrtl433net.codec_for(data).decode(data)
+		except Exception:
+			self._load.errors += 1
+			return
+
+		ent = self._inflight.pop(ret.get('seq'), None)
+		if ent is None:
+			# Already timed out
+			self._load.late += 1
+			return
+
+		sent,n,fut = ent
+		if fut is not None:
+			if not fut.done():
+				fut.set_result(ret)
+			return
+		self._load.response(time.monotonic() - sent, n, ret)
+
+	def request(self, req, n=0, fut=None):
+		"""
+		Send @req with @n packets in it, @fut gets the response if it is given.
+		"""
+
+		self._seq += 1
+		self._inflight[self._seq] = [time.monotonic(), n, fut]
+		self.transport.sendto(self._codec.encode(dict(req, session=self.session, seq=self._seq)))
+
+	async def call(self, req, timeout, tries=5):
+		"""
+		Send @req and return the response, or None if there was none after @tries tries of @timeout seconds.
+		"""
+
+		for i in range(tries):
+			fut = asyncio.get_running_loop().create_future()
+			self.request(req, 0, fut)
+			try:
+				return await asyncio.wait_for(fut, timeout)
+			except asyncio.TimeoutError:
+				self._inflight.pop(self._seq, None)
+		return None
+
+	async def getconfig(self, codec, timeout):
+		"""
+		Ask for the configuration like a client does, and use @codec from then on if the server takes it.
+		"""
+
+		ret = await self.call({'cmd': 'getconfig', 'codecs': [codec]}, timeout)
+		if ret is None:
+			raise Exception("No response from the server")
+		self._codec = pyrtl433net.CODECS.get(ret.get('codec'), pyrtl433net.jsoncodec)
+		return ret['config']
+
+	def flush(self, batch):
+		"""
+		Send the pending packets, @batch to a request.
+		"""
+
+		while len(self.pending):
+			dat = self.pending[:batch]
+			del self.pending[:batch]
+			if batch == 1:
+				self.request({'cmd': 'packet', 'packet': dat[0]}, 1)
+			else:
+				self.request({'cmd': 'batch', 'packets': dat}, len(dat))
+
+	def expire(self, now, timeout):
+		"""
+		Give up on requests sent more than @timeout seconds before @now.
+		"""
+
+		for seq,ent in list(self._inflight.items()):
+			if ent[2] is None and now - ent[0] > timeout:
+				del self._inflight[seq]
+				self._load.timeouts += ent[1]
+
+	def __len__(self):
+		return len(self._inflight)
+
+class loadgen:
+	"""
+	Sends made up packets from @sessions virtual clients to the server at @hostport (HOST or HOST:PORT over UDP).
+
+	@batch is the most packets in one request, 1 sends packet requests.
+	@codec is the wire codec to ask the server for.
+	@sensors is the number of sensors, each is heard by one session.
+	@overlap is the fraction of transmissions that are also heard by other sessions, @copies sessions in all.
+	@burst_factor is how many times the rate goes up in a burst, bursts are the last @burst_length seconds of every
+	@burst_every seconds. A factor of 1 is no bursts.
+	@timeout is how long to wait for a response before counting the packets in the request as lost.
+	"""
+
+	def __init__(self, hostport, sessions=DEFAULT_SESSIONS, batch=1, codec=pyrtl433net.jsoncodec.name, sensors=DEFAULT_SENSORS, overlap=DEFAULT_OVERLAP, copies=DEFAULT_COPIES, burst_factor=1.0, burst_length=1.0, burst_every=10.0, timeout=DEFAULT_TIMEOUT):
+		if ':' in hostport:
+			host,port = hostport.rsplit(':', 1)
+			port = int(port)
+		else:
+			host = hostport
+			port = pyrtl433net.DEFAULT_PORT
+		self._addr = (host, port)
+
+		self.batch = batch
+		self.codec = codec
+		self.overlap = overlap
+		self.copies = max(min(copies, sessions), 1)
+		self.burst_factor = burst_factor
+		self.burst_length = burst_length
+		self.burst_every = burst_every
+		self.timeout = timeout
+
+		self._n = sessions
+		self._sessions = []
+		# Asks the server for its statistics
+		self._control = None
+
+		self._packets = pyrtl433net.bench.fake_sensors(sensors)
+		self._random = random.Random()
+
+		self._reset()
+
+	def _reset(self):
+		"""
+		Start counting again for a new step.
+		"""
+
+		self.sent = 0
+		self.acked = 0
+		self.busy = 0
+		self.timeouts = 0
+		self.errors = 0
+		self.late = 0
+		self.rtt = pyrtl433net.histogram()
+
+	def response(self, rtt, n, ret):
+		"""
+		Count response @ret to a request with @n packets that took @rtt seconds.
+		"""
+
+		self.rtt.record(rtt)
+		if ret.get('ret') == 'ok':
+			self.acked += n
+		elif ret.get('ret') == 'busy':
+			accepted = ret.get('accepted', 0)
+			self.acked += accepted
+			self.busy += n - accepted
+		else:
+			self.errors += n
+
+	async def start(self):
+		"""
+		Open the sessions and have each get the configuration.
+		"""
+
+		loop = asyncio.get_running_loop()
+		family,_,_,_,addr = socket.getaddrinfo(self._addr[0], self._addr[1], type=socket.SOCK_DGRAM)[0]
+		for i in range(self._n + 1):
+			transport,protocol = await loop.create_datagram_endpoint(lambda: session(self), remote_addr=addr, family=family)
+			self._sessions.append(protocol)
+		self._control = self._sessions.pop()
+
+		await self._control.getconfig(pyrtl433net.jsoncodec.name, self.timeout)
+		await asyncio.gather(*[_.getconfig(self.codec, self.timeout) for _ in self._sessions])
+
+	def close(self):
+		for s in self._sessions + [self._control]:
+			if s is not None and s.transport is not None:
+				s.transport.close()
+
+	async def serverstats(self):
+		"""
+		Return the packets received and dropped by the dispatcher so far according to the server, or None if it didn't say.
+		"""
+
+		ret = await self._control.call({'cmd': 'stats'}, self.timeout)
+		if ret is None or 'stats' not in ret:
+			return None
+		st = ret['stats']
+		return sum(_['packets'] for _ in st['metrics']['clients'].values()), st.get('dispatch', {}).get('dropped', 0)
+
+	def _due(self, rate, t):
+		"""
+		Transmissions due @t seconds into a step at @rate per second, counting bursts.
+		"""
+
+		full,part = divmod(t, self.burst_every)
+		bursting = full * self.burst_length + max(part - (self.burst_every - self.burst_length), 0.0)
+		return int(rate * (t + (self.burst_factor - 1) * bursting))
+
+	def _transmit(self):
+		"""
+		Hand the next transmission to the session of its sensor, and to other sessions too if it overlaps.
+		"""
+
+		packet = next(self._packets)
+		home = packet['id'] % self._n
+		self._sessions[home].pending.append(packet)
+		self.sent += 1
+
+		if self.copies > 1 and self._random.random() < self.overlap:
+			others = self._random.sample([_ for _ in range(self._n) if _ != home], self.copies - 1)
+			for i in others:
+				# Same transmission, heard differently
+				self._sessions[i].pending.append(dict(packet, rssi=round(packet['rssi'] - self._random.uniform(0, 10), 3), snr=round(packet['snr'] - self._random.uniform(0, 5), 3)))
+				self.sent += 1
+
+	async def step(self, rate, duration):
+		"""
+		Send transmissions at @rate per second for @duration seconds, wait for the responses, and return a dictionary of what happened.
+		"""
+
+		self._reset()
+		before = await self.serverstats()
+		cpu = time.process_time()
+
+		start = time.monotonic()
+		done = 0
+		while True:
+			await asyncio.sleep(TICK)
+			now = time.monotonic()
+			elapsed = min(now - start, duration)
+
+			due = self._due(rate, elapsed)
+			for i in range(due - done):
+				self._transmit()
+			done = due
+
+			for s in self._sessions:
+				s.flush(self.batch)
+				s.expire(now, self.timeout)
+
+			if elapsed >= duration:
+				break
+
+		# Responses still on the way
+		while any(len(_) for _ in self._sessions):
+			await asyncio.sleep(TICK)
+			now = time.monotonic()
+			for s in self._sessions:
+				s.expire(now, self.timeout)
+
+		cpu = time.process_time() - cpu
+		after = await self.serverstats()
+
+		ret = {
+			'rate': rate,
+			'duration': duration,
+			'sent': self.sent,
+			'acked': self.acked,
+			'busy': self.busy,
+			'timeouts': self.timeouts,
+			'errors': self.errors,
+			'late': self.late,
+			'loss': (self.sent - self.acked) / self.sent if self.sent else 0.0,
+			'offered_rate': self.sent / duration,
+			'acked_rate': self.acked / duration,
+			'rtt': self.rtt.stats(),
+			'cpu': cpu / (time.monotonic() - start),
+		}
+		if before is not None and after is not None:
+			ret['server_received'] = after[0] - before[0]
+			ret['server_dropped'] = after[1] - before[1]
+		return ret
+
+	async def ramp(self, start_rate=DEFAULT_START_RATE, factor=DEFAULT_RAMP, duration=DEFAULT_STEP, max_rate=0.0, loss=DEFAULT_LOSS, progress=None):
+		"""
+		Run steps of @duration seconds from @start_rate transmissions per second, going up by @factor each step, until more
+		than @loss of the packets in a step are lost or @max_rate (0 for no limit) is done.
+		@progress is called with the result of each step as it finishes.
+		Returns a dictionary of the steps, the last step within @loss, and the first step where any packet was lost.
+		"""
+
+		steps = []
+		rate = start_rate
+		while True:
+			res = await self.step(rate, duration)
+			steps.append(res)
+			if progress is not None:
+				progress(res)
+
+			if res['loss'] > loss or (max_rate and rate >= max_rate):
+				break
+			rate = rate * factor
+			if max_rate:
+				rate = min(rate, max_rate)
+
+		return {
+			'steps': steps,
+			'sustained': ([None] + [_ for _ in steps if _['loss'] <= loss])[-1],
+			'drops': ([_ for _ in steps if _['sent'] > _['acked']] + [None])[0],
+		}
+
+def parse_args(args=None):
+	"""
+	Given a list of args @args, parse them and return the parser object.
+	If @args is None, then it will pull from the sys.argv.
+	"""
+
+	p = argparse.ArgumentParser(
+		prog="pyrtl433net.loadgen",
+		description="Ramp up the load from many virtual clients in one process to find the most packets per second a pyrtl433net server takes"
+	)
+	p.add_argument('--client', action="store", nargs=1, metavar="IP:[PORT]", required=True, help="Server to load, as given to --client of pyrtl433net (UDP only)")
+	p.add_argument('--sessions', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_SESSIONS], help="Virtual clients, default is %d" % DEFAULT_SESSIONS)
+	p.add_argument('--batch', action="store", nargs=1, type=int, metavar="N", default=[1], help="Most packets in one request, default is 1 (no batching)")
+	p.add_argument('--codec', action="store", nargs=1, choices=list(pyrtl433net.CODECS), default=[pyrtl433net.jsoncodec.name], help="Wire codec to ask the server for, default is json")
+	p.add_argument('--sensors', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_SENSORS], help="Sensors spread over the clients, default is %d" % DEFAULT_SENSORS)
+	p.add_argument('--overlap', action="store", nargs=1, type=float, metavar="FRACTION", default=[DEFAULT_OVERLAP], help="Fraction of transmissions heard by more than one client, default is %.1f" % DEFAULT_OVERLAP)
+	p.add_argument('--copies', action="store", nargs=1, type=int, metavar="N", default=[DEFAULT_COPIES], help="Clients that hear an overlapping transmission, default is %d" % DEFAULT_COPIES)
+	p.add_argument('--burst-factor', action="store", nargs=1, type=float, metavar="X", default=[1.0], help="Rate goes up this many times during a burst, default is 1 (no bursts)")
+	p.add_argument('--burst-length', action="store", nargs=1, type=float, metavar="SEC", default=[1.0], help="Seconds a burst lasts, default is 1")
+	p.add_argument('--burst-every', action="store", nargs=1, type=float, metavar="SEC", default=[10.0], help="Seconds from one burst to the next, default is 10")
+	p.add_argument('--start-rate', action="store", nargs=1, type=float, metavar="N", default=[DEFAULT_START_RATE], help="Transmissions per second of the first step, default is %d" % DEFAULT_START_RATE)
+	p.add_argument('--ramp', action="store", nargs=1, type=float, metavar="X", default=[DEFAULT_RAMP], help="Rate is multiplied by this each step, default is %.1f" % DEFAULT_RAMP)
+	p.add_argument('--max-rate', action="store", nargs=1, type=float, metavar="N", default=[0.0], help="Stop after the step at this rate, default is no limit")
+	p.add_argument('--step', action="store", nargs=1, type=float, metavar="SEC", default=[DEFAULT_STEP], help="Seconds each step lasts, default is %.1f" % DEFAULT_STEP)
+	p.add_argument('--loss', action="store", nargs=1, type=float, metavar="FRACTION", default=[DEFAULT_LOSS], help="Stop once more than this fraction of packets are refused or unanswered, default is %.2f" % DEFAULT_LOSS)
+	p.add_argument('--timeout', action="store", nargs=1, type=float, metavar="SEC", default=[DEFAULT_TIMEOUT], help="Seconds to wait for a response before the packets are counted as lost, default is %.1f" % DEFAULT_TIMEOUT)
+
+	return p.parse_args(args)
+
+def _print_step(res):
+	line = "%8.1f/s: sent %d (%.1f/s), acked %d (%.1f/s), busy %d, timed out %d, loss %.2f%%, rtt p50 %.3f ms p99 %.3f ms, cpu %.0f%%" % (
+		res['rate'], res['sent'], res['offered_rate'], res['acked'], res['acked_rate'], res['busy'], res['timeouts'],
+		100 * res['loss'], 1000 * res['rtt']['p50'], 1000 * res['rtt']['p99'], 100 * res['cpu'])
+	if 'server_received' in res:
+		line += ", server got %d" % res['server_received']
+	print(line, flush=True)
+
+async def _main(args):
+	load = loadgen(args.client[0], sessions=args.sessions[0], batch=args.batch[0], codec=args.codec[0], sensors=args.sensors[0],
+		overlap=args.overlap[0], copies=args.copies[0], burst_factor=args.burst_factor[0], burst_length=args.burst_length[0],
+		burst_every=args.burst_every[0], timeout=args.timeout[0])
+	try:
+		await load.start()
+		print("%d sessions connected to %s" % (args.sessions[0], args.client[0]))
+		return await load.ramp(args.start_rate[0], args.ramp[0], args.step[0], args.max_rate[0], args.loss[0], _print_step)
+	finally:
+		load.close()
+
+def main(args=None):
+	args = parse_args(args)
+	res = asyncio.run(_main(args))
+
+	if res['sustained'] is None:
+		print("Server didn't keep up with the first step")
+	else:
+		print("Most sustained: %.1f transmissions/s, %.1f packets/s acknowledged" % (res['sustained']['rate'], res['sustained']['acked_rate']))
+	if res['drops'] is None:
+		print("No drops")
+	else:
+		print("Drops started at %.1f transmissions/s (%.1f packets/s offered)" % (res['drops']['rate'], res['drops']['offered_rate']))
+
+if __name__ == '__main__':
+	main()
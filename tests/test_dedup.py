@@ -0,0 +1,55 @@
+import pyrtl433net
+
+CONFIG = """[server]
+interface = 127.0.0.1
+port = 4333
+
+[rtl433]
+frequency = 915M
+metadata = level
+fsk = minimax
+
+[rtl433.decoders]
+
+[dedup]
+mode = %s
+ignore = time rssi
+"""
+
+def _server(tmp_path, mode):
+	fname = tmp_path / 'server.cfg'
+	fname.write_text(CONFIG % mode)
+	s = pyrtl433net.server()
+	s.load(str(fname))
+	return s
+
+def _copies():
+	"""
+	Same transmission heard by two radios, differing only in fields left out of the fingerprint.
+	"""
+
+	a = {'model': 'Fineoffset-WH51', 'id': '0d7e2a', 'moisture': 42, 'time': '2024-08-27 11:29:44', 'rssi': -0.1, 'ts': 1724758184.12, 'radio': '0'}
+	b = dict(a, time='2024-08-27 11:29:45', rssi=-3.2, ts=1724758184.31, radio='1')
+	return a,b
+
+def test_drop_custom_ignore_keeps_added_fields(tmp_path):
+	s = _server(tmp_path, 'drop')
+	assert s._dedup.ignore == {'time', 'rssi', 'ts', 'radio'}
+
+	a,b = _copies()
+	fp = s._dedup.check(a, now=0.0)
+	assert fp is not None
+	s._dedup.add(fp, now=0.0)
+	assert s._dedup.check(b, now=0.1) is None
+
+def test_aggregate_custom_ignore_keeps_added_fields(tmp_path):
+	s = _server(tmp_path, 'aggregate')
+	assert s._aggregator.ignore == {'time', 'rssi', 'ts', 'radio'}
+
+	a,b = _copies()
+	assert pyrtl433net.fingerprint(a, s._aggregator.ignore) == pyrtl433net.fingerprint(b, s._aggregator.ignore)
+
+def test_fingerprint_differs_on_data():
+	d = pyrtl433net.deduplicator(ignore=())
+	a,b = _copies()
+	assert pyrtl433net.fingerprint(a, d.ignore) != pyrtl433net.fingerprint(dict(a, moisture=43), d.ignore)